@@ -1,161 +1,314 @@
 # app.py
-from flask import Flask, render_template, request, jsonify, session, redirect, url_for, flash
+from flask import Flask, render_template, request, jsonify, session, redirect, url_for, flash, abort, send_file
 import sqlite3
 import json
+import os
+import secrets
+import threading
+import time
 from datetime import datetime
 
+from cart_store import LazyCartStore, create_cart_store
+from catalog_snapshot import decode_cursor, encode_cursor, load_snapshot, normalize_sort, read_catalog_version
+from db_pool import ConnectionPool
+from fragment_cache import FragmentCache
+from http_cache import HttpCache
+from image_store import EXTENSIONS, MIME_TYPES, SIZES as IMAGE_SIZES, ImageStore
+from json_provider import FastJSONProvider
+from metrics import Instrumentation, TimedConnection
+from price_history import DEFAULT_POINTS, MAX_POINTS, downsample, load_price_history
+
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'your_secret_key'
+# Быстрая сериализация JSON (orjson, если установлен)
+app.json = FastJSONProvider(app)
+
+# Настройки SQLite для веб-процесса
+app.config['CATALOG_DB'] = os.environ.get('CATALOG_DB', 'iphones_catalog.db')
+app.config['SQLITE_CACHE_SIZE'] = int(os.environ.get('SQLITE_CACHE_SIZE', -16000))
+app.config['SQLITE_MMAP_SIZE'] = int(os.environ.get('SQLITE_MMAP_SIZE', 64 * 1024 * 1024))
+# immutable=1: '1' - всегда, '0' - никогда, не задано - если файловая система смонтирована на чтение
+app.config['SQLITE_IMMUTABLE'] = {'1': True, '0': False}.get(os.environ.get('SQLITE_IMMUTABLE'))
+
+# HTTP-кэширование: размер LRU готовых ответов и время жизни в браузере/CDN
+app.config['HTTP_CACHE_SIZE'] = int(os.environ.get('HTTP_CACHE_SIZE', 256))
+app.config['HTTP_CACHE_MAX_AGE'] = int(os.environ.get('HTTP_CACHE_MAX_AGE', 60))
+app.config['HTTP_CACHE_S_MAXAGE'] = int(os.environ.get('HTTP_CACHE_S_MAXAGE', 300))
+# Кэш отрисованных карточек товаров (число фрагментов во всех версиях каталога)
+app.config['FRAGMENT_CACHE_SIZE'] = int(os.environ.get('FRAGMENT_CACHE_SIZE', 20000))
+
+# Метрики (/metrics, Server-Timing) и профилирование запросов медленнее PROFILE_SLOW_MS (0 - выключено).
+# Включаются явно; /metrics отдается только с loopback или по METRICS_TOKEN (Authorization: Bearer)
+app.config['METRICS_ENABLED'] = os.environ.get('METRICS_ENABLED', '0') == '1'
+app.config['METRICS_TOKEN'] = os.environ.get('METRICS_TOKEN')
+app.config['PROFILE_SLOW_MS'] = float(os.environ.get('PROFILE_SLOW_MS', 0))
+app.config['PROFILE_SAMPLE_RATE'] = float(os.environ.get('PROFILE_SAMPLE_RATE', 1.0))
+app.config['PROFILE_DIR'] = os.environ.get('PROFILE_DIR', 'profiles')
+
+# Корзины: бэкенд ('sqlite' - на сервере, 'cookie' - в cookie сессии, 'memory' - для разработки),
+# отдельная база и период отложенной записи. На Vercel (read-only диск, много экземпляров) - cookie
+app.config['CART_STORE'] = os.environ.get('CART_STORE', 'cookie' if os.environ.get('VERCEL') else 'sqlite')
+app.config['CART_DB'] = os.environ.get('CART_DB', 'carts.db')
+app.config['CART_FLUSH_INTERVAL'] = float(os.environ.get('CART_FLUSH_INTERVAL', 1.0))
+
+# Локальные копии изображений товаров (image_store.py): каталог файлов и срок кэша адресов без версии
+app.config['IMAGE_DIR'] = os.environ.get('IMAGE_DIR', 'image_cache')
+app.config['IMAGE_MAX_AGE'] = int(os.environ.get('IMAGE_MAX_AGE', 86400))
 
 
 class iPhoneCatalog:
-    def __init__(self, db_path='iphones_catalog.db'):
+    def __init__(self, db_path='iphones_catalog.db', check_interval=2.0, pool=None):
         self.db_path = db_path
+        # Соединения на чтение, переиспользуемые между запросами в каждом потоке
+        self.pool = pool or ConnectionPool(db_path)
+        # Как часто (в секундах) сверять версию каталога в базе
+        self.check_interval = check_interval
+        self._snapshot = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+    
+    def snapshot(self):
+        """Текущий снимок каталога; перезагружается при смене версии в базе
+        или замене файла базы новым поколением (publish.py)"""
+        snapshot = self._snapshot
+        if snapshot is not None and time.monotonic() - self._checked_at < self.check_interval:
+            return snapshot
+        
+        with self._lock:
+            # Другой поток мог уже обновить снимок, пока мы ждали блокировку
+            if self._snapshot is not None and time.monotonic() - self._checked_at < self.check_interval:
+                return self._snapshot
+            
+            if self.pool.check_replaced():
+                print(f"🔄 База {self.db_path} заменена новым поколением - соединения переоткрываются")
+            conn = self.pool.connection()
+            version = read_catalog_version(conn)
+            if self._snapshot is None or self._snapshot.version != version:
+                # Замена ссылки атомарна: читатели видят либо старый, либо новый снимок
+                self._snapshot = load_snapshot(conn, version)
+            
+            self._checked_at = time.monotonic()
+            return self._snapshot
+    
+    def invalidate(self):
+        """Принудительная сверка версии при следующем обращении"""
+        self._checked_at = 0.0
     
     def get_all_products(self, category=None, sort_by='price_desc', search=None):
         """Получение всех товаров с фильтрацией"""
-        conn = sqlite3.connect(self.db_path)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
+        snapshot = self.snapshot()
         
-        # Базовый запрос
-        query = '''
-            SELECT ic.*, 
-                   GROUP_CONCAT(DISTINCT icc.color_name) as all_colors,
-                   GROUP_CONCAT(DISTINCT icm.memory_size) as all_memory
-            FROM iphones_catalog ic
-            LEFT JOIN iphone_catalog_colors icc ON ic.product_id = icc.product_id
-            LEFT JOIN iphone_catalog_memory icm ON ic.product_id = icm.product_id
-        '''
+        # Готовый отсортированный срез категории из предрасчитанного индекса
+        products = [snapshot.products[product_id] for product_id in snapshot.ordered_ids(category, sort_by)]
         
-        conditions = []
-        params = []
-        
-        # Фильтр по категории
-        if category and category != 'all':
-            conditions.append("ic.category = ?")
-            params.append(category)
-        
-        # Поиск
+        # Поиск по индексу (фильтрация сохраняет порядок сортировки)
         if search:
-            conditions.append("(ic.model LIKE ? OR ic.current_color LIKE ?)")
-            params.extend([f'%{search}%', f'%{search}%'])
-        
-        if conditions:
-            query += " WHERE " + " AND ".join(conditions)
+            matched = snapshot.search(search)
+            if matched is not None:
+                products = [p for p in products if p['product_id'] in matched]
         
-        # Группировка
-        query += " GROUP BY ic.product_id"
+        return [dict(product) for product in products]
+    
+    def get_encoded(self, key, build):
+        """JSON-байты build(), сериализованные один раз на версию каталога"""
+        return self.snapshot().payload(key, lambda: app.json.dumps_bytes(build()))
+    
+    def get_products_page(self, category=None, sort_by='price_desc', search=None, limit=24, cursor=None):
+        """Страница товаров с курсорной пагинацией.
         
-        # Сортировка
-        if sort_by == 'price_asc':
-            query += " ORDER BY ic.price ASC"
-        elif sort_by == 'price_desc':
-            query += " ORDER BY ic.price DESC"
-        elif sort_by == 'name':
-            query += " ORDER BY ic.model ASC"
+        Возвращает (товары, курсор следующей страницы или None). Курсор хранит
+        позицию последнего товара в сортировке, поэтому выдача не сбивается
+        при перезагрузке каталога. ValueError - при некорректном курсоре.
+        """
+        snapshot = self.snapshot()
+        if cursor:
+            ids = snapshot.ids_after(category, sort_by, decode_cursor(cursor, sort_by))
         else:
-            query += " ORDER BY ic.display_order ASC"
+            ids = snapshot.ordered_ids(category, sort_by)
         
-        cursor.execute(query, params)
-        products = [dict(row) for row in cursor.fetchall()]
+        matched = snapshot.search(search) if search else None
         
-        # Форматируем данные для отображения
-        for product in products:
-            product['formatted_price'] = f"{product['price']:,} руб.".replace(',', ' ')
-            product['short_model'] = product['model'][:30] + '...' if len(product['model']) > 30 else product['model']
-            
-            # Обрабатываем цвета и память
-            if product['all_colors']:
-                product['colors_list'] = product['all_colors'].split(',')
-            else:
-                product['colors_list'] = [product['current_color']] if product['current_color'] else []
-            
-            if product['all_memory']:
-                product['memory_list'] = product['all_memory'].split(',')
-            else:
-                product['memory_list'] = [product['current_memory']] if product['current_memory'] else []
+        page = []
+        for product_id in ids:
+            if matched is not None and product_id not in matched:
+                continue
+            page.append(snapshot.products[product_id])
+            if len(page) > limit:
+                break
         
-        conn.close()
-        return products
+        # Взяли на один товар больше, чтобы понять, есть ли следующая страница
+        next_cursor = encode_cursor(sort_by, page[limit - 1]) if len(page) > limit else None
+        return [dict(product) for product in page[:limit]], next_cursor
+    
+    def get_stats(self):
+        """Сводка по каталогу: всего товаров, по категориям, диапазон цен, фасеты цветов и памяти"""
+        stats = self.snapshot().stats
+        return {
+            'total_products': stats['total_products'],
+            'featured_count': stats['featured_count'],
+            'categories': dict(stats['categories']),
+            'min_price': stats['min_price'],
+            'max_price': stats['max_price'],
+            'colors': dict(stats['colors']),
+            'memory': dict(stats['memory']),
+        }
+    
+    def count_products(self, category=None):
+        """Количество товаров (в категории) без выборки самих товаров"""
+        return len(self.snapshot().ids_for_category(category))
     
     def get_categories(self):
         """Получение списка категорий"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT category, COUNT(*) as count 
-            FROM iphones_catalog 
-            GROUP BY category 
-            ORDER BY count DESC
-        ''')
-        
-        categories = [{'name': row[0], 'count': row[1]} for row in cursor.fetchall()]
-        conn.close()
-        return categories
+        return [{'name': name, 'count': count} for name, count in self.snapshot().categories]
     
     def get_featured_products(self, limit=6):
         """Получение рекомендуемых товаров"""
-        conn = sqlite3.connect(self.db_path)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT * FROM iphones_catalog 
-            WHERE is_featured = 1 
-            ORDER BY price DESC 
-            LIMIT ?
-        ''', (limit,))
-        
-        products = [dict(row) for row in cursor.fetchall()]
-        for product in products:
-            product['formatted_price'] = f"{product['price']:,} руб.".replace(',', ' ')
-        
-        conn.close()
-        return products
+        snapshot = self.snapshot()
+        return [snapshot.get(product_id) for product_id in snapshot.featured[:limit]]
     
     def get_product_by_id(self, product_id):
         """Получение товара по ID"""
-        conn = sqlite3.connect(self.db_path)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
+        product = self.snapshot().get(product_id)
+        if product:
+            # Для карточки товара показываем только реально доступные варианты
+            if not product['all_colors']:
+                product['colors_list'] = ()
+            if not product['all_memory']:
+                product['memory_list'] = ()
+        return product
+
+    def get_similar_products(self, product_id, limit=4):
+        """Похожие товары (категория, цена, поколение, общие варианты памяти и цветов)"""
+        snapshot = self.snapshot()
+        return [snapshot.get(similar_id) for similar_id in snapshot.similar(product_id, limit)]
+    
+    def get_image(self, product_id):
+        """Обработанные копии изображения товара или None"""
+        return self.snapshot().image(product_id)
+    
+    def get_price_history(self, product_id, start=None, end=None, max_points=DEFAULT_POINTS):
+        """История цены товара за период, прореженная до max_points точек.
         
-        cursor.execute('''
-            SELECT ic.*, 
-                   GROUP_CONCAT(DISTINCT icc.color_name) as all_colors,
-                   GROUP_CONCAT(DISTINCT icm.memory_size) as all_memory
-            FROM iphones_catalog ic
-            LEFT JOIN iphone_catalog_colors icc ON ic.product_id = icc.product_id
-            LEFT JOIN iphone_catalog_memory icm ON ic.product_id = icm.product_id
-            WHERE ic.product_id = ?
-            GROUP BY ic.product_id
-        ''', (product_id,))
+        Читается из базы по запросу: в снимок каталога история не входит.
+        """
+        points = load_price_history(self.pool.connection(), product_id, start, end)
+        return downsample(points, max_points)
+    
+    def get_products_by_ids(self, product_ids):
+        """Получение нескольких товаров за одно обращение к снимку.
         
-        product = cursor.fetchone()
-        if product:
-            product = dict(product)
-            product['formatted_price'] = f"{product['price']:,} руб.".replace(',', ' ')
-            
-            if product['all_colors']:
-                product['colors_list'] = product['all_colors'].split(',')
-            else:
-                product['colors_list'] = []
-            
-            if product['all_memory']:
-                product['memory_list'] = product['all_memory'].split(',')
+        Возвращает (товары в порядке переданных ID, список отсутствующих ID).
+        """
+        snapshot = self.snapshot()
+        products = []
+        missing = []
+        for product_id in product_ids:
+            product = snapshot.get(product_id)
+            if product is None:
+                missing.append(product_id)
             else:
-                product['memory_list'] = []
-        
-        conn.close()
-        return product
+                products.append(product)
+        return products, missing
 
 # Инициализация каталога
-catalog = iPhoneCatalog()
+catalog = iPhoneCatalog(
+    app.config['CATALOG_DB'],
+    pool=ConnectionPool(
+        app.config['CATALOG_DB'],
+        immutable=app.config['SQLITE_IMMUTABLE'],
+        cache_size=app.config['SQLITE_CACHE_SIZE'],
+        mmap_size=app.config['SQLITE_MMAP_SIZE'],
+        factory=TimedConnection if app.config['METRICS_ENABLED'] else sqlite3.Connection,
+    ),
+)
+
+if app.config['METRICS_ENABLED']:
+    instrumentation = Instrumentation(
+        app,
+        profile_slow_ms=app.config['PROFILE_SLOW_MS'],
+        profile_sample_rate=app.config['PROFILE_SAMPLE_RATE'],
+        profile_dir=app.config['PROFILE_DIR'],
+        metrics_token=app.config['METRICS_TOKEN'],
+    )
+
+def open_cart_store():
+    """Хранилище корзин по настройкам приложения (вызывается при первом обращении)"""
+    if app.config['CART_STORE'] != 'sqlite':
+        return create_cart_store(app.config['CART_STORE'])
+    try:
+        return create_cart_store(
+            'sqlite',
+            db_path=app.config['CART_DB'],
+            flush_interval=app.config['CART_FLUSH_INTERVAL'],
+        )
+    except sqlite3.Error as e:
+        # Каталог только для чтения (serverless) - корзины остаются в cookie
+        print(f"⚠️ База корзин {app.config['CART_DB']} недоступна ({e}) - корзины хранятся в cookie")
+        return create_cart_store('cookie')
+
 
+cart_store = LazyCartStore(open_cart_store)
 
 
+def current_cart_id(create=False):
+    """ID корзины текущей сессии - непрозрачный токен в cookie вместо самой корзины"""
+    cart_id = session.get('cart_id')
+    # В cookie-хранилище session['cart'] - сама корзина, а не наследие
+    legacy_cart = None if cart_store.in_session else session.pop('cart', None)
+    if cart_id is None and (create or legacy_cart):
+        cart_id = session['cart_id'] = secrets.token_urlsafe(16)
+    # Корзина из cookie (до переноса на сервер) переезжает в хранилище
+    for product_id, quantity in (legacy_cart or {}).items():
+        cart_store.add(cart_id, product_id, quantity)
+    return cart_id
+
+
+def cart_count():
+    """Количество товаров в корзине текущей сессии"""
+    return cart_store.count(current_cart_id())
+
+
+images = ImageStore(app.config['IMAGE_DIR'])
+
+
+def product_image(product, size='card'):
+    """Адрес изображения товара нужного размера.
+
+    Если копии уже сделаны - локальный /img с версией в адресе (кэшируется
+    бессрочно), иначе - оригинал с сайта поставщика.
+    """
+    image = catalog.get_image(product['product_id'])
+    if image is None or size not in image:
+        return product.get('image_url') or None
+    return url_for('product_image_file', product_id=product['product_id'], size=size, v=image['version'])
+
+
+fragment_cache = FragmentCache(
+    app.jinja_env,
+    catalog.snapshot,
+    maxsize=app.config['FRAGMENT_CACHE_SIZE'],
+    context={'product_image': product_image},
+)
+
+
+http_cache = HttpCache(
+    catalog.snapshot,
+    maxsize=app.config['HTTP_CACHE_SIZE'],
+    max_age=app.config['HTTP_CACHE_MAX_AGE'],
+    s_maxage=app.config['HTTP_CACHE_S_MAXAGE'],
+    user_key=cart_count,
+)
+
+
+
+def project_fields(products, fields):
+    """Оставляет в товарах только запрошенные поля (?fields=product_id,model,price)"""
+    if not fields:
+        return products
+    return [{field: product[field] for field in fields if field in product} for product in products]
+
 @app.route('/')
+@http_cache.cached(per_user=True)
 def index():
     """Главная страница"""
     featured_products = catalog.get_featured_products(6)
@@ -164,9 +317,10 @@ def index():
     return render_template('index.html', 
                          featured_products=featured_products,
                          categories=categories,
-                         total_products=len(catalog.get_all_products()))
+                         total_products=catalog.count_products())
 
 @app.route('/catalog')
+@http_cache.cached(per_user=True)
 def catalog_page():
     """Страница каталога"""
     category = request.args.get('category', 'all')
@@ -185,6 +339,7 @@ def catalog_page():
                          total_products=len(products))
 
 @app.route('/product/<product_id>')
+@http_cache.cached(per_user=True)
 def product_detail(product_id):
     """Страница товара"""
     product = catalog.get_product_by_id(product_id)
@@ -192,56 +347,142 @@ def product_detail(product_id):
         return "Товар не найден", 404
     
     # Похожие товары
-    similar_products = catalog.get_all_products(category=product['category'])[:4]
+    similar_products = catalog.get_similar_products(product_id, 4)
     
     return render_template('product.html',
                          product=product,
                          similar_products=similar_products)
 
 @app.route('/api/products')
+@http_cache.cached()
 def api_products():
     """API для получения товаров (для AJAX)"""
     category = request.args.get('category', 'all')
-    sort_by = request.args.get('sort', 'price_desc')
+    # Неизвестная сортировка - как сортировка по умолчанию (и один ключ кэша на нее)
+    sort_by = normalize_sort(request.args.get('sort', 'price_desc'))
     search = request.args.get('search', '')
     
+    fields = [field for field in request.args.get('fields', '').split(',') if field]
+    
+    # Постраничная выдача для мини-приложения: ?limit=N[&cursor=...]
+    if 'limit' in request.args or 'cursor' in request.args:
+        limit = max(1, min(request.args.get('limit', 24, type=int), 100))
+        try:
+            products, next_cursor = catalog.get_products_page(
+                category, sort_by, search, limit, request.args.get('cursor'))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        return jsonify({'items': project_fields(products, fields), 'next_cursor': next_cursor})
+    
+    # Самый частый запрос - весь каталог без фильтров: отдаем готовые байты
+    if category == 'all' and not search and not fields:
+        payload = catalog.get_encoded(('products', sort_by),
+                                      lambda: catalog.get_all_products(category, sort_by))
+        return app.json.bytes_response(payload)
+    
     products = catalog.get_all_products(category, sort_by, search)
-    return jsonify(products)
+    return jsonify(project_fields(products, fields))
+
+@app.route('/api/products/<product_id>/similar')
+@http_cache.cached()
+def api_similar_products(product_id):
+    """API похожих товаров"""
+    if catalog.get_product_by_id(product_id) is None:
+        return jsonify({'error': 'Товар не найден'}), 404
+    
+    limit = request.args.get('limit', 4, type=int)
+    return jsonify(catalog.get_similar_products(product_id, max(1, min(limit, 12))))
+
+@app.route('/api/products/<product_id>/price_history')
+@http_cache.cached()
+def api_price_history(product_id):
+    """API истории цены: ?from=&to= (unix-время), ?points= (не больше 1000)"""
+    start = request.args.get('from', type=int)
+    end = request.args.get('to', type=int)
+    max_points = max(2, min(request.args.get('points', DEFAULT_POINTS, type=int), MAX_POINTS))
+    
+    points, resolution = catalog.get_price_history(product_id, start, end, max_points)
+    # Снятый с продажи товар не в каталоге, но его история остается доступной
+    if not points and catalog.get_product_by_id(product_id) is None:
+        return jsonify({'error': 'Товар не найден'}), 404
+    
+    return jsonify({
+        'product_id': product_id,
+        'from': start,
+        'to': end,
+        'resolution': resolution,
+        'points': points,
+    })
+
+def original_image(product_id):
+    """Перенаправление на оригинал изображения с сайта поставщика"""
+    product = catalog.get_product_by_id(product_id)
+    if product is None or not product['image_url']:
+        abort(404)
+    return redirect(product['image_url'])
+
+@app.route('/img/<product_id>/<size>')
+def product_image_file(product_id, size):
+    """Копия изображения товара: WebP, если браузер его принимает, иначе JPEG"""
+    if size not in IMAGE_SIZES:
+        abort(404)
+    
+    image = catalog.get_image(product_id)
+    variants = image.get(size) if image else None
+    if not variants:
+        # Копий еще нет - отправляем к оригиналу
+        return original_image(product_id)
+    
+    if 'webp' in variants and request.accept_mimetypes['image/webp']:
+        image_format = 'webp'
+    else:
+        image_format = 'jpeg' if 'jpeg' in variants else next(iter(variants))
+    digest = variants[image_format]
+    
+    path = images.open(digest, EXTENSIONS[image_format])
+    if path is None:
+        # Файл вытеснен из хранилища после загрузки снимка каталога
+        return original_image(product_id)
+    
+    # Адрес с версией меняется вместе с картинкой - его можно кэшировать бессрочно
+    versioned = request.args.get('v') == image['version']
+    response = send_file(path, mimetype=MIME_TYPES[image_format], etag=digest, conditional=True,
+                         max_age=31536000 if versioned else app.config['IMAGE_MAX_AGE'])
+    # Формат зависит от Accept - кэши должны хранить варианты отдельно
+    response.vary.add('Accept')
+    response.cache_control.immutable = versioned
+    return response
 
 @app.route('/api/categories')
+@http_cache.cached()
 def api_categories():
     """API для получения категорий"""
-    categories = catalog.get_categories()
-    return jsonify(categories)
+    payload = catalog.get_encoded(('categories',), catalog.get_categories)
+    return app.json.bytes_response(payload)
 
 @app.route('/cart')
 def cart():
     """Страница корзины"""
-    if 'cart' not in session:
-        session['cart'] = {}
+    cart_id = current_cart_id()
+    cart_items = cart_store.items(cart_id)
+    cart_products, missing = catalog.get_products_by_ids(list(cart_items))
     
-    cart_products = []
-    total_price = 0
+    # Убираем из корзины товары, которых больше нет в каталоге
+    if missing:
+        cart_store.remove(cart_id, *missing)
     
-    for product_id, quantity in session['cart'].items():
-        product = catalog.get_product_by_id(product_id)
-        if product:
-            product['quantity'] = quantity
-            product['total_price'] = product['price'] * quantity
-            cart_products.append(product)
-            total_price += product['total_price']
+    total_price = 0
+    for product in cart_products:
+        product['quantity'] = cart_items[product['product_id']]
+        product['total_price'] = product['price'] * product['quantity']
+        total_price += product['total_price']
             
-    return render_template('cart.html', cart_products=cart_products, total_price=total_price, catalog=catalog, total_products=len(catalog.get_all_products()))
+    return render_template('cart.html', cart_products=cart_products, total_price=total_price, total_products=catalog.count_products())
 
 @app.route('/add_to_cart/<product_id>')
 def add_to_cart(product_id):
     """Добавление товара в корзину"""
-    if 'cart' not in session:
-        session['cart'] = {}
-    
-    cart = session['cart']
-    cart[product_id] = cart.get(product_id, 0) + 1
-    session['cart'] = cart
+    cart_store.add(current_cart_id(create=True), product_id)
     
     flash('Товар добавлен в корзину!', 'success')
     return redirect(request.referrer or url_for('index'))
@@ -249,25 +490,36 @@ def add_to_cart(product_id):
 @app.route('/remove_from_cart/<product_id>')
 def remove_from_cart(product_id):
     """Удаление товара из корзины"""
-    if 'cart' in session and product_id in session['cart']:
-        session['cart'].pop(product_id)
+    if cart_store.remove(current_cart_id(), product_id):
         flash('Товар удален из корзины!', 'info')
     return redirect(url_for('cart'))
 
 @app.route('/clear_cart')
 def clear_cart():
     """Очистка корзины"""
-    session.pop('cart', None)
+    cart_store.clear(current_cart_id())
     flash('Корзина очищена!', 'info')
     return redirect(url_for('cart'))
 
+@app.context_processor
+def inject_catalog_total():
+    """Общее количество товаров для футера (без выборки всего каталога)"""
+    return dict(catalog_total=catalog.count_products())
+
 @app.context_processor
 def inject_cart_count():
     """Доступное количество товаров в корзине во всех шаблонах"""
-    cart_count = 0
-    if 'cart' in session:
-        cart_count = sum(session['cart'].values())
-    return dict(cart_count=cart_count)
+    return dict(cart_count=cart_count())
+
+@app.context_processor
+def inject_product_image():
+    """Адреса изображений товаров в шаблонах: product_image(product, 'thumb' | 'card' | 'detail')"""
+    return dict(product_image=product_image)
+
+@app.context_processor
+def inject_product_cards():
+    """Карточки товаров из кэша фрагментов: product_cards('catalog_card', products)"""
+    return dict(product_cards=fragment_cache.render_many)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,334 @@
+# cart_store.py
+import atexit
+import sqlite3
+import threading
+from collections import OrderedDict
+
+from flask import session
+
+from db_pool import enable_wal
+
+
+class Cart:
+    """Корзина одной сессии: товары и поддерживаемое на ходу число единиц"""
+
+    __slots__ = ('items', 'count')
+
+    def __init__(self, items=None):
+        self.items = dict(items or {})
+        self.count = sum(self.items.values())
+
+
+class MemoryCartStore:
+    """Корзины в памяти процесса (для разработки и тестов).
+
+    Все операции - O(1) под одной блокировкой, поэтому атомарны при
+    многопоточном сервере. Наружу отдаются только копии.
+    """
+
+    # Корзина хранится не в cookie сессии (см. CookieCartStore)
+    in_session = False
+
+    def __init__(self):
+        self._carts = {}
+        self._lock = threading.Lock()
+
+    def _cart(self, cart_id):
+        """Корзина по ID (вызывается под блокировкой); None - корзины нет"""
+        return self._carts.get(cart_id)
+
+    def _changed(self, cart_id, cart, product_ids):
+        """Уведомление об изменении товаров корзины (вызывается под блокировкой)"""
+
+    def _create(self, cart_id):
+        cart = self._carts[cart_id] = Cart()
+        return cart
+
+    def items(self, cart_id):
+        """Копия товаров корзины: product_id -> количество"""
+        if not cart_id:
+            return {}
+        with self._lock:
+            cart = self._cart(cart_id)
+            return dict(cart.items) if cart is not None else {}
+
+    def count(self, cart_id):
+        """Число единиц товара в корзине (без пересчета)"""
+        if not cart_id:
+            return 0
+        with self._lock:
+            cart = self._cart(cart_id)
+            return cart.count if cart is not None else 0
+
+    def add(self, cart_id, product_id, quantity=1):
+        """Добавление товара; возвращает новое количество этого товара"""
+        with self._lock:
+            cart = self._cart(cart_id) or self._create(cart_id)
+            cart.items[product_id] = cart.items.get(product_id, 0) + quantity
+            cart.count += quantity
+            self._changed(cart_id, cart, (product_id,))
+            return cart.items[product_id]
+
+    def remove(self, cart_id, *product_ids):
+        """Удаление товаров из корзины; возвращает True, если что-то удалено"""
+        with self._lock:
+            cart = self._cart(cart_id)
+            if cart is None:
+                return False
+            removed = [product_id for product_id in product_ids if product_id in cart.items]
+            for product_id in removed:
+                cart.count -= cart.items.pop(product_id)
+            if removed:
+                self._changed(cart_id, cart, removed)
+            return bool(removed)
+
+    def clear(self, cart_id):
+        """Очистка корзины"""
+        with self._lock:
+            cart = self._cart(cart_id)
+            if cart is None or not cart.items:
+                return
+            removed = list(cart.items)
+            cart.items.clear()
+            cart.count = 0
+            self._changed(cart_id, cart, removed)
+
+    def flush(self):
+        """Запись отложенных изменений (в памяти - нечего записывать)"""
+
+
+class SQLiteCartStore(MemoryCartStore):
+    """Корзины в SQLite с локальным кэшем и отложенной записью (write-behind).
+
+    Операции меняют корзину в памяти и помечают измененные товары; фоновый
+    поток раз в flush_interval секунд пишет в базу только их (одна транзакция
+    на все корзины). flush_interval=0 - запись сразу (для serverless, где
+    фоновые потоки ненадежны). Кэш локален для процесса: при нескольких
+    процессах-воркерах нужны sticky-сессии или flush_interval=0 и maxsize=0.
+
+    Корзины хранятся в отдельной базе: база каталога открыта веб-процессом
+    только на чтение и целиком заменяется при публикации нового каталога.
+    """
+
+    def __init__(self, db_path='carts.db', flush_interval=1.0, maxsize=10000):
+        super().__init__()
+        self.db_path = db_path
+        self.flush_interval = flush_interval
+        self.maxsize = maxsize
+        self._carts = OrderedDict()
+        # cart_id -> ID товаров, измененных с последней записи
+        self._dirty = {}
+        # Корзины, чьи изменения сейчас пишутся в базу (их нельзя вытеснять)
+        self._writing = set()
+        # Порядок блокировок: _flush_order -> _lock -> _db_lock
+        self._flush_order = threading.Lock()
+        self._db_lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._create_tables()
+
+        self._stopped = threading.Event()
+        if flush_interval > 0:
+            threading.Thread(target=self._flush_loop, daemon=True).start()
+            atexit.register(self.close)
+
+    def _create_tables(self):
+        enable_wal(self._conn)
+        self._conn.execute('''
+            CREATE TABLE IF NOT EXISTS carts (
+                cart_id TEXT PRIMARY KEY,
+                updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        self._conn.execute('''
+            CREATE TABLE IF NOT EXISTS cart_items (
+                cart_id TEXT NOT NULL,
+                product_id TEXT NOT NULL,
+                quantity INTEGER NOT NULL,
+                PRIMARY KEY (cart_id, product_id)
+            ) WITHOUT ROWID
+        ''')
+        self._conn.commit()
+
+    def _cart(self, cart_id):
+        cart = self._carts.get(cart_id)
+        if cart is not None:
+            self._carts.move_to_end(cart_id)
+            return cart
+
+        with self._db_lock:
+            rows = self._conn.execute(
+                'SELECT product_id, quantity FROM cart_items WHERE cart_id = ?', (cart_id,)
+            ).fetchall()
+        if not rows:
+            return None
+        cart = self._carts[cart_id] = Cart(rows)
+        self._evict()
+        return cart
+
+    def _create(self, cart_id):
+        cart = self._carts[cart_id] = Cart()
+        self._evict()
+        return cart
+
+    def _evict(self):
+        """Вытеснение давно не используемых корзин, уже записанных в базу"""
+        while len(self._carts) > self.maxsize:
+            for cart_id in self._carts:
+                if cart_id not in self._dirty and cart_id not in self._writing:
+                    del self._carts[cart_id]
+                    break
+            else:
+                # Все корзины ждут записи - вытесним после flush
+                return
+
+    def _changed(self, cart_id, cart, product_ids):
+        # Корзина могла быть вытеснена, пока вызывающий с ней работал
+        self._carts[cart_id] = cart
+        self._dirty.setdefault(cart_id, set()).update(product_ids)
+        if self.flush_interval <= 0:
+            # Запись сразу, в той же атомарной операции
+            self._write(self._take_dirty())
+            self._writing = set()
+        self._evict()
+
+    def _take_dirty(self):
+        """Изменения для записи в базу (вызывается под self._lock)"""
+        upserts, deletes, touched = [], [], []
+        for cart_id, product_ids in self._dirty.items():
+            cart = self._carts[cart_id]
+            for product_id in product_ids:
+                quantity = cart.items.get(product_id)
+                if quantity:
+                    upserts.append((cart_id, product_id, quantity))
+                else:
+                    deletes.append((cart_id, product_id))
+            touched.append((cart_id,))
+        self._writing = set(self._dirty)
+        self._dirty = {}
+        return upserts, deletes, touched
+
+    def _write(self, changes):
+        """Запись изменений одной транзакцией"""
+        upserts, deletes, touched = changes
+        if not touched:
+            return
+        with self._db_lock, self._conn:
+            self._conn.executemany('DELETE FROM cart_items WHERE cart_id = ? AND product_id = ?', deletes)
+            self._conn.executemany('''
+                INSERT INTO cart_items (cart_id, product_id, quantity) VALUES (?, ?, ?)
+                ON CONFLICT(cart_id, product_id) DO UPDATE SET quantity = excluded.quantity
+            ''', upserts)
+            # Время последнего изменения корзины (для очистки брошенных)
+            self._conn.executemany('''
+                INSERT INTO carts (cart_id, updated_at) VALUES (?, CURRENT_TIMESTAMP)
+                ON CONFLICT(cart_id) DO UPDATE SET updated_at = excluded.updated_at
+            ''', touched)
+
+    def flush(self):
+        """Запись всех отложенных изменений; операции с корзинами на это время не блокируются"""
+        with self._flush_order:
+            with self._lock:
+                changes = self._take_dirty()
+            try:
+                self._write(changes)
+            except Exception:
+                # Не записалось - вернем изменения в очередь до следующей попытки
+                with self._lock:
+                    upserts, deletes, _ = changes
+                    for cart_id, product_id, *_ in upserts + deletes:
+                        self._dirty.setdefault(cart_id, set()).add(product_id)
+                raise
+            finally:
+                with self._lock:
+                    self._writing = set()
+                    self._evict()
+
+    def _flush_loop(self):
+        while not self._stopped.wait(self.flush_interval):
+            try:
+                self.flush()
+            except sqlite3.Error as e:
+                print(f"❌ Ошибка записи корзин: {e}")
+
+    def close(self):
+        """Остановка фоновой записи и сохранение оставшихся изменений"""
+        self._stopped.set()
+        self.flush()
+
+
+class CookieCartStore:
+    """Корзина в подписанной cookie сессии Flask (как до переноса на сервер).
+
+    Не нужны ни запись на диск, ни общее состояние процессов - подходит для
+    serverless (Vercel): файловая система только для чтения, а запросы
+    расходятся по разным экземплярам. cart_id не используется; размер
+    cookie (~4 КБ) ограничивает корзину несколькими десятками позиций.
+    """
+
+    in_session = True
+
+    def _items(self):
+        return session.get('cart') or {}
+
+    def _save(self, items):
+        session['cart'] = items
+
+    def items(self, cart_id):
+        return dict(self._items())
+
+    def count(self, cart_id):
+        return sum(self._items().values())
+
+    def add(self, cart_id, product_id, quantity=1):
+        items = dict(self._items())
+        items[product_id] = items.get(product_id, 0) + quantity
+        self._save(items)
+        return items[product_id]
+
+    def remove(self, cart_id, *product_ids):
+        items = dict(self._items())
+        removed = [product_id for product_id in product_ids if items.pop(product_id, None) is not None]
+        if removed:
+            self._save(items)
+        return bool(removed)
+
+    def clear(self, cart_id):
+        if self._items():
+            self._save({})
+
+    def flush(self):
+        """Запись отложенных изменений (cookie уходит с ответом)"""
+
+
+class LazyCartStore:
+    """Хранилище, создаваемое при первом обращении к корзине.
+
+    Импорт приложения не создает базу корзин и не запускает поток записи:
+    это происходит только в процессе, который действительно обслуживает запросы.
+    """
+
+    def __init__(self, factory):
+        self._factory = factory
+        self._store = None
+        self._lock = threading.Lock()
+
+    def _get(self):
+        if self._store is None:
+            with self._lock:
+                if self._store is None:
+                    self._store = self._factory()
+        return self._store
+
+    def __getattr__(self, name):
+        return getattr(self._get(), name)
+
+
+def create_cart_store(backend='sqlite', **options):
+    """Хранилище корзин по имени бэкенда ('sqlite', 'cookie' или 'memory')"""
+    if backend == 'memory':
+        return MemoryCartStore()
+    if backend == 'cookie':
+        return CookieCartStore()
+    if backend == 'sqlite':
+        return SQLiteCartStore(**options)
+    raise ValueError(f'Неизвестное хранилище корзин: {backend}')
@@ -0,0 +1,242 @@
+# catalog_snapshot.py
+import base64
+import hashlib
+import json
+import sqlite3
+from bisect import bisect_right
+from datetime import datetime, timezone
+from types import MappingProxyType
+
+from http_cache import LRUCache
+from image_store import load_product_images
+from read_model import build_products, load_read_model
+from search_index import SearchIndex
+from similar_index import SimilarIndex
+
+
+# Поддерживаемые сортировки каталога (ключ сортировки повторяет ORDER BY из SQL)
+SORT_KEYS = {
+    'price_asc': lambda p: p['price'] or 0,
+    'price_desc': lambda p: -(p['price'] or 0),
+    'name': lambda p: p['model'],
+    'display_order': lambda p: p['display_order'] or 0,
+}
+DEFAULT_SORT = 'display_order'
+
+# Сколько готовых сериализованных ответов хранить на версию каталога
+PAYLOAD_CACHE_SIZE = 32
+
+
+def normalize_sort(sort_by):
+    """Поддерживаемая сортировка: неизвестные значения - как DEFAULT_SORT"""
+    return sort_by if sort_by in SORT_KEYS else DEFAULT_SORT
+
+
+def sort_position(sort_by, product):
+    """Позиция товара в порядке сортировки: ключ сортировки + product_id"""
+    key = SORT_KEYS.get(sort_by) or SORT_KEYS[DEFAULT_SORT]
+    return (key(product), product['product_id'])
+
+
+def encode_cursor(sort_by, product):
+    """Курсор страницы: позиция последнего товара (не смещение), поэтому
+    переживает перезагрузку каталога"""
+    payload = json.dumps([sort_by, *sort_position(sort_by, product)], ensure_ascii=False)
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor, sort_by):
+    """Разбор курсора; ValueError, если курсор поврежден или от другой сортировки"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        cursor_sort, key, product_id = json.loads(base64.urlsafe_b64decode(padded).decode('utf-8'))
+    except (ValueError, TypeError, UnicodeDecodeError):
+        raise ValueError('Некорректный курсор')
+    if cursor_sort != sort_by:
+        raise ValueError('Курсор от другой сортировки')
+    key_type = str if sort_by == 'name' else int
+    if type(key) is not key_type or not isinstance(product_id, str):
+        raise ValueError('Некорректный курсор')
+    return (key, product_id)
+
+
+def read_catalog_version(conn):
+    """Версия каталога в базе: счетчик и время изменения из catalog_meta,
+    время парсинга и число товаров"""
+    try:
+        meta = dict(conn.execute("SELECT key, value FROM catalog_meta WHERE key IN ('version', 'modified_at')"))
+    except sqlite3.OperationalError:
+        # Старая база без таблицы catalog_meta
+        meta = {}
+
+    parsed_at, count = conn.execute('SELECT MAX(parsed_at), COUNT(*) FROM iphones_catalog').fetchone()
+    return (meta.get('version', 0), meta.get('modified_at'), parsed_at, count)
+
+
+def catalog_modified_at(version):
+    """Время изменения каталога (UTC) по его версии или None, если оно неизвестно.
+
+    Берется из базы, а не из момента загрузки снимка, поэтому Last-Modified
+    одинаков во всех процессах и не меняется после перезапуска.
+    """
+    _, modified_at, parsed_at, _ = version
+    if modified_at:
+        return datetime.fromtimestamp(modified_at, timezone.utc)
+    # База без отметки в catalog_meta: время последнего парсинга (локальное время парсера)
+    try:
+        return datetime.fromisoformat(parsed_at).astimezone(timezone.utc).replace(microsecond=0)
+    except (TypeError, ValueError):
+        return None
+
+
+class CatalogSnapshot:
+    """Неизменяемый снимок каталога в памяти.
+
+    Строится один раз на версию каталога; все методы iPhoneCatalog читают
+    из него вместо запросов к SQLite. Наружу отдаются только копии товаров.
+    """
+
+    def __init__(self, version, products, images=None):
+        self.version = version
+        # Короткий идентификатор версии (для ETag) и время изменения каталога (для Last-Modified)
+        self.version_tag = hashlib.sha1(repr(version).encode('utf-8')).hexdigest()[:16]
+        self.last_modified = catalog_modified_at(version)
+
+        # Базовый порядок - как у GROUP BY ic.product_id
+        products = sorted(products, key=lambda p: p['product_id'])
+        self.order = tuple(p['product_id'] for p in products)
+        self.products = MappingProxyType({p['product_id']: p for p in products})
+
+        by_category = {}
+        for product in products:
+            by_category.setdefault(product['category'], []).append(product['product_id'])
+        self.by_category = MappingProxyType({name: tuple(ids) for name, ids in by_category.items()})
+
+        # Категории: ORDER BY count DESC, при равенстве - порядок GROUP BY category
+        grouped = sorted(self.by_category.items(), key=lambda item: item[0] or '')
+        self.categories = tuple(
+            (name, len(ids)) for name, ids in sorted(grouped, key=lambda item: -len(item[1]))
+        )
+
+        # Предсортированные индексы: sort_by -> категория ('all' - весь каталог) -> ID.
+        # Сортировка стабильная поверх порядка product_id, поэтому порядок при
+        # равных ключах совпадает с GROUP BY + ORDER BY.
+        self.sorted_ids = {}
+        for sort_by, key in SORT_KEYS.items():
+            ordered = sorted(products, key=key)
+            buckets = {category: [] for category in self.by_category}
+            for product in ordered:
+                buckets[product['category']].append(product['product_id'])
+            buckets = {category: tuple(ids) for category, ids in buckets.items()}
+            buckets['all'] = tuple(p['product_id'] for p in ordered)
+            self.sorted_ids[sort_by] = MappingProxyType(buckets)
+        self.sorted_ids = MappingProxyType(self.sorted_ids)
+
+        self.search_index = SearchIndex(products)
+        self.similar_index = SimilarIndex(products)
+
+        featured = [p for p in products if p.get('is_featured')]
+        featured.sort(key=lambda p: -(p['price'] or 0))
+        self.featured = tuple(p['product_id'] for p in featured)
+
+        self.stats = _aggregate(products, self.categories, len(self.featured))
+
+        # Обработанные изображения: product_id -> размер -> формат -> хэш файла
+        self.images = MappingProxyType(images or {})
+
+        # Готовые сериализованные ответы для этой версии каталога (LRU: ключи
+        # строятся из параметров запроса, их число не должно расти без предела)
+        self._payloads = LRUCache(PAYLOAD_CACHE_SIZE)
+
+    def __len__(self):
+        return len(self.order)
+
+    def payload(self, key, build):
+        """Закэшированный для этой версии результат build() (например, байты JSON)"""
+        payload = self._payloads.get(key)
+        if payload is None:
+            payload = build()
+            self._payloads.set(key, payload)
+        return payload
+
+    def get(self, product_id):
+        """Копия товара по ID или None"""
+        product = self.products.get(product_id)
+        return dict(product) if product is not None else None
+
+    def ids_for_category(self, category=None):
+        """ID товаров категории (или всего каталога)"""
+        if category and category != 'all':
+            return self.by_category.get(category, ())
+        return self.order
+
+    def search(self, query):
+        """ID товаров по поисковому запросу (None - без фильтра)"""
+        return self.search_index.search(query)
+
+    def similar(self, product_id, limit=4):
+        """ID похожих товаров из предрасчитанного индекса"""
+        return self.similar_index.get(product_id, limit)
+
+    def image(self, product_id):
+        """Копии изображения товара ({'version': ..., размер: {формат: хэш}}) или None"""
+        return self.images.get(product_id)
+
+    def ordered_ids(self, category=None, sort_by=DEFAULT_SORT):
+        """ID товаров категории в порядке сортировки - готовый срез индекса"""
+        buckets = self.sorted_ids.get(sort_by) or self.sorted_ids[DEFAULT_SORT]
+        if category and category != 'all':
+            return buckets.get(category, ())
+        return buckets['all']
+
+    def ids_after(self, category, sort_by, position):
+        """ID товаров, идущих в порядке сортировки после позиции курсора"""
+        ids = self.ordered_ids(category, sort_by)
+        if sort_by not in self.sorted_ids:
+            sort_by = DEFAULT_SORT
+        start = bisect_right(ids, tuple(position),
+                             key=lambda product_id: sort_position(sort_by, self.products[product_id]))
+        return ids[start:]
+
+
+def _aggregate(products, categories, featured_count):
+    """Сводные данные каталога за один проход: количество, цены, фасеты"""
+    prices = []
+    colors = {}
+    memory = {}
+    for product in products:
+        # Нулевая цена означает "Не указана" - в диапазон цен не попадает
+        if product['price']:
+            prices.append(product['price'])
+        for color in product['colors_list']:
+            colors[color] = colors.get(color, 0) + 1
+        for memory_size in product['memory_list']:
+            memory[memory_size] = memory.get(memory_size, 0) + 1
+
+    def by_count(facet):
+        return MappingProxyType(dict(sorted(facet.items(), key=lambda item: (-item[1], item[0]))))
+
+    return MappingProxyType({
+        'total_products': len(products),
+        'featured_count': featured_count,
+        'categories': MappingProxyType(dict(categories)),
+        'min_price': min(prices) if prices else 0,
+        'max_price': max(prices) if prices else 0,
+        'colors': by_count(colors),
+        'memory': by_count(memory),
+    })
+
+
+def load_snapshot(conn, version=None):
+    """Загрузка снимка каталога: из витрины catalog_read_model одним запросом,
+    а для баз без витрины - сборкой из исходных таблиц"""
+    conn.row_factory = sqlite3.Row
+    if version is None:
+        version = read_catalog_version(conn)
+
+    products = load_read_model(conn)
+    if products is None:
+        products = build_products(conn)
+
+    return CatalogSnapshot(version, [MappingProxyType(product) for product in products],
+                           load_product_images(conn))
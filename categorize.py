@@ -0,0 +1,144 @@
+# categorize.py
+import json
+import re
+
+# Правила категорий по порядку: побеждает первое совпавшее.
+# Условия правила (все необязательные, проверяются вместе):
+#   model     - регулярное выражение по названию модели (без учета регистра)
+#   memory    - регулярное выражение по текущему объему памяти
+#   min_price / max_price - границы цены включительно
+#   used      - True/False: товар Б/У или новый
+# Другие линейки стоят раньше правил iPhone, чтобы "iPad Pro" не стал "iPhone Pro".
+CATEGORY_RULES = (
+    {'category': 'iPad', 'model': r'\bipad\b'},
+    {'category': 'Mac', 'model': r'\b(macbook|imac|mac\s*(mini|studio|pro))\b'},
+    {'category': 'AirPods', 'model': r'\bairpods\b'},
+    {'category': 'Apple Watch', 'model': r'\bapple\s*watch\b'},
+    {'category': 'iPhone Pro Max', 'model': r'Pro Max'},
+    {'category': 'iPhone Pro', 'model': r'Pro'},
+    {'category': 'iPhone Plus', 'model': r'Plus'},
+    {'category': 'iPhone Б/У', 'used': True},
+)
+DEFAULT_CATEGORY = 'iPhone'
+
+# Товар попадает в рекомендуемые, если подходит под любое из правил
+FEATURED_RULES = (
+    {'min_price': 80001},
+)
+
+# Признак Б/У в названии модели
+USED_RE = re.compile(r'б/у', re.IGNORECASE)
+
+
+class Rule:
+    """Одно правило: условия, скомпилированные в список проверок"""
+
+    def __init__(self, spec):
+        self.spec = dict(spec)
+        self.category = spec.get('category')
+        self.model_re = re.compile(spec['model'], re.IGNORECASE) if spec.get('model') else None
+        self.memory_re = re.compile(spec['memory'], re.IGNORECASE) if spec.get('memory') else None
+        self.min_price = spec.get('min_price')
+        self.max_price = spec.get('max_price')
+        self.used = spec.get('used')
+
+    def matches(self, model_matched, used, price, memory):
+        if self.model_re is not None and not model_matched:
+            return False
+        if self.used is not None and self.used != used:
+            return False
+        if self.min_price is not None and price < self.min_price:
+            return False
+        if self.max_price is not None and price > self.max_price:
+            return False
+        if self.memory_re is not None and not self.memory_re.search(memory or ''):
+            return False
+        return True
+
+
+class RuleEngine:
+    """Категоризация и отбор рекомендуемых товаров по набору правил.
+
+    Регулярные выражения по модели - самая дорогая часть - считаются один раз
+    на уникальное название (в каталоге тысячи SKU, но сотни моделей), цена и
+    память проверяются простыми сравнениями. Весь каталог - один проход.
+    """
+
+    def __init__(self, category_rules=CATEGORY_RULES, featured_rules=FEATURED_RULES,
+                 default_category=DEFAULT_CATEGORY):
+        self.category_rules = [Rule(spec) for spec in category_rules]
+        self.featured_rules = [Rule(spec) for spec in featured_rules]
+        self.default_category = default_category
+        self._rules = self.category_rules + self.featured_rules
+        self._models = {}
+
+    @classmethod
+    def from_file(cls, path):
+        """Набор правил из JSON: {"categories": [...], "featured": [...], "default": "..."}"""
+        with open(path, 'r', encoding='utf-8') as f:
+            config = json.load(f)
+        return cls(config.get('categories', CATEGORY_RULES),
+                   config.get('featured', FEATURED_RULES),
+                   config.get('default', DEFAULT_CATEGORY))
+
+    def _model_info(self, model):
+        """(совпадения регулярок модели по правилам, признак Б/У) - с кэшем по названию"""
+        info = self._models.get(model)
+        if info is None:
+            text = model or ''
+            matched = tuple(rule.model_re is not None and rule.model_re.search(text) is not None
+                            for rule in self._rules)
+            info = self._models[model] = (matched, USED_RE.search(text) is not None)
+        return info
+
+    def evaluate(self, model, price, memory=None):
+        """(категория, рекомендуемый ли товар) для одного товара"""
+        matched, used = self._model_info(model)
+        price = price or 0
+        category = self.default_category
+        for index, rule in enumerate(self.category_rules):
+            if rule.matches(matched[index], used, price, memory):
+                category = rule.category
+                break
+        offset = len(self.category_rules)
+        featured = any(rule.matches(matched[offset + index], used, price, memory)
+                       for index, rule in enumerate(self.featured_rules))
+        return category, int(featured)
+
+
+def apply_rules(cursor, engine=None, product_ids=None):
+    """Пересчет category / is_featured / display_order.
+
+    product_ids=None - весь каталог, иначе только указанные товары. В базу
+    пишутся лишь строки, у которых результат отличается от сохраненного.
+    Возвращает ID измененных товаров.
+    """
+    engine = engine or RuleEngine()
+
+    where = ''
+    if product_ids is not None:
+        cursor.execute('CREATE TEMP TABLE IF NOT EXISTS categorize_ids (product_id TEXT PRIMARY KEY)')
+        cursor.execute('DELETE FROM categorize_ids')
+        cursor.executemany('INSERT OR IGNORE INTO categorize_ids VALUES (?)', ((pid,) for pid in product_ids))
+        where = 'WHERE product_id IN (SELECT product_id FROM categorize_ids)'
+
+    rows = cursor.execute(f'''
+        SELECT id, product_id, model, price, current_memory, category, is_featured, display_order
+        FROM iphones_catalog {where}
+    ''').fetchall()
+
+    updates = []
+    changed_ids = []
+    for row_id, product_id, model, price, memory, category, is_featured, display_order in rows:
+        new_category, new_featured = engine.evaluate(model, price, memory)
+        # Порядок отображения - порядок добавления товара (как rowid раньше)
+        if (new_category, new_featured, row_id) != (category, is_featured, display_order):
+            updates.append((new_category, new_featured, row_id, row_id))
+            changed_ids.append(product_id)
+
+    # Обновление по id (rowid) - без поиска по индексу product_id
+    cursor.executemany(
+        'UPDATE iphones_catalog SET category = ?, is_featured = ?, display_order = ? WHERE id = ?',
+        updates
+    )
+    return changed_ids
@@ -0,0 +1,341 @@
+# crawler.py
+import hashlib
+import json
+import os
+import sqlite3
+import sys
+import threading
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from contextlib import nullcontext
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urljoin, urlsplit, urlunsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from fast_pars import quick_parse
+from image_store import ImagePipeline, serve_sample_images
+from migrations import migrate
+from parsing import IPhoneCatalogParser, iPhoneDatabase, lxml_html
+from publish import MIN_PRODUCTS_RATIO, publish_database
+
+# Параметры запроса, которыми сайты обычно нумеруют страницы каталога
+PAGE_PARAMS = ('page', 'p', 'pg', 'PAGEN_1')
+
+
+def parse_catalog_page(html_content, page_url):
+    """Разбор страницы каталога (выполняется в пуле процессов).
+
+    Возвращает (товары, ссылки на другие страницы каталога).
+    """
+    parser = IPhoneCatalogParser('lxml')
+    tree = lxml_html.document_fromstring(html_content)
+    return parser._extract_products_lxml(tree), sorted(discover_pages(tree, page_url))
+
+
+def parse_product_page(html_content, page_url):
+    """Разбор страницы товара (выполняется в пуле процессов)"""
+    return quick_parse(html_content), []
+
+
+def discover_pages(tree, page_url):
+    """Ссылки пагинации: rel=next и ссылки на тот же путь с номером страницы"""
+    base = urlsplit(page_url)
+    pages = set()
+
+    for href in tree.xpath("//link[@rel='next']/@href | //a[@rel='next']/@href"):
+        pages.add(urljoin(page_url, href))
+
+    for href in tree.xpath('//a/@href'):
+        url = urlsplit(urljoin(page_url, href))
+        if url.netloc == base.netloc and url.path == base.path:
+            if any(param in parse_qs(url.query) for param in PAGE_PARAMS):
+                pages.add(urlunsplit(url._replace(fragment='')))
+
+    pages.discard(page_url)
+    return {url for url in pages if urlsplit(url).netloc == base.netloc}
+
+
+def page_order(page_url):
+    """Ключ сортировки страниц каталога: адрес без номера страницы, затем номер.
+
+    Номер сравнивается как число (?page=2 раньше ?page=10), страница без
+    номера считается первой.
+    """
+    url = urlsplit(page_url)
+    query = parse_qs(url.query, keep_blank_values=True)
+    number = 1
+    for param in PAGE_PARAMS:
+        values = query.pop(param, None)
+        if values and values[0].isdigit():
+            number = int(values[0])
+    rest = sorted((key, value) for key, values in query.items() for value in values)
+    return url.scheme, url.netloc, url.path, rest, number
+
+
+class CatalogCrawler:
+    """Обход каталога поставщика: страницы каталога (с пагинацией) и товаров.
+
+    - один requests.Session с пулом соединений и повторами с backoff;
+    - ограниченная параллельность загрузки (пул потоков);
+    - условные запросы (ETag / If-Modified-Since): неизменившиеся страницы
+      не скачиваются и не разбираются, товары берутся из кэша crawl_pages;
+    - разбор HTML вынесен в пул процессов.
+    """
+
+    def __init__(self, start_urls, db_name='iphones_catalog.db', max_workers=8, max_pages=500,
+                 timeout=15, retries=3, backoff_factor=0.5, fetch_product_pages=False, use_processes=True):
+        self.start_urls = [start_urls] if isinstance(start_urls, str) else list(start_urls)
+        self.db_name = db_name
+        self.max_workers = max_workers
+        self.max_pages = max_pages
+        self.timeout = timeout
+        self.fetch_product_pages = fetch_product_pages
+        self.use_processes = use_processes
+        self.session = self._make_session(retries, backoff_factor)
+        self._migrate()
+
+    def _make_session(self, retries, backoff_factor):
+        """HTTP-сессия с пулом соединений и повторами при сбоях"""
+        session = requests.Session()
+        session.headers.update(IPhoneCatalogParser().headers)
+        retry = Retry(
+            total=retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=(429, 500, 502, 503, 504),
+            allowed_methods=frozenset(['GET']),
+            respect_retry_after_header=True,
+        )
+        adapter = HTTPAdapter(pool_connections=self.max_workers, pool_maxsize=self.max_workers, max_retries=retry)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+
+    def _migrate(self):
+        """Схема базы, включая кэш условных запросов crawl_pages (migrations.py)"""
+        conn = sqlite3.connect(self.db_name)
+        try:
+            migrate(conn)
+        finally:
+            conn.close()
+
+    def _load_cache(self):
+        conn = sqlite3.connect(self.db_name)
+        try:
+            return {row[0]: row[1:] for row in conn.execute(
+                'SELECT url, etag, last_modified, data, links FROM crawl_pages')}
+        finally:
+            conn.close()
+
+    def _save_cache(self, pages):
+        conn = sqlite3.connect(self.db_name)
+        try:
+            conn.executemany('''
+                INSERT INTO crawl_pages (url, etag, last_modified, data, links, fetched_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT(url) DO UPDATE SET
+                    etag = excluded.etag,
+                    last_modified = excluded.last_modified,
+                    data = excluded.data,
+                    links = excluded.links,
+                    fetched_at = excluded.fetched_at
+            ''', [(page['url'], page['etag'], page['last_modified'],
+                   json.dumps(page['data'], ensure_ascii=False), json.dumps(page['links']),
+                   datetime.now().isoformat()) for page in pages if page['status'] == 200])
+            conn.commit()
+        finally:
+            conn.close()
+
+    def _fetch(self, url, cached, parse, parsers):
+        """Загрузка и разбор одной страницы (выполняется в пуле потоков)"""
+        headers = {}
+        if cached:
+            etag, last_modified = cached[0], cached[1]
+            if etag:
+                headers['If-None-Match'] = etag
+            if last_modified:
+                headers['If-Modified-Since'] = last_modified
+
+        page = {'url': url, 'status': None, 'data': None, 'links': [], 'etag': None, 'last_modified': None}
+        try:
+            response = self.session.get(url, headers=headers, timeout=self.timeout)
+        except requests.RequestException as e:
+            page['error'] = str(e)
+            return page
+
+        page['status'] = response.status_code
+        if response.status_code == 304 and cached:
+            # Страница не изменилась: берем результат прошлого разбора
+            page['data'] = json.loads(cached[2])
+            page['links'] = json.loads(cached[3])
+            return page
+        if response.status_code != 200:
+            page['error'] = f'HTTP {response.status_code}'
+            return page
+
+        page['etag'] = response.headers.get('ETag')
+        page['last_modified'] = response.headers.get('Last-Modified')
+        if parsers is not None:
+            page['data'], page['links'] = parsers.submit(parse, response.text, url).result()
+        else:
+            page['data'], page['links'] = parse(response.text, url)
+        return page
+
+    def _run(self, urls, parse, cache, parsers, follow_links):
+        """Параллельный обход списка страниц (с догрузкой найденных ссылок)"""
+        pages = []
+        seen = set(urls)
+        with ThreadPoolExecutor(max_workers=self.max_workers) as fetchers:
+            pending = {fetchers.submit(self._fetch, url, cache.get(url), parse, parsers) for url in urls}
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    page = future.result()
+                    pages.append(page)
+                    if not follow_links:
+                        continue
+                    for link in page['links']:
+                        if link not in seen and len(seen) < self.max_pages:
+                            seen.add(link)
+                            pending.add(fetchers.submit(self._fetch, link, cache.get(link), parse, parsers))
+        return pages
+
+    def _product_page_url(self, product_url):
+        """URL страницы товара на хосте обходимого каталога"""
+        base = urlsplit(self.start_urls[0])
+        url = urlsplit(product_url)
+        return urlunsplit((base.scheme, base.netloc, url.path, url.query, ''))
+
+    def crawl(self):
+        """Полный обход; результат совместим с iPhoneDatabase.save_catalog"""
+        print(f"🌐 Обход каталога: {', '.join(self.start_urls)}")
+        cache = self._load_cache()
+
+        pool = ProcessPoolExecutor() if self.use_processes else nullcontext(None)
+        with pool as parsers:
+            catalog_pages = self._run(self.start_urls, parse_catalog_page, cache, parsers, follow_links=True)
+
+            # Товары в порядке номеров страниц, повторы - по последнему вхождению
+            products = {}
+            for page in sorted(catalog_pages, key=lambda p: page_order(p['url'])):
+                for product in page['data'] or []:
+                    products[product['product_id']] = product
+
+            product_pages = []
+            if self.fetch_product_pages:
+                urls = sorted({self._product_page_url(p['product_url']) for p in products.values() if p['product_url']})
+                product_pages = self._run(urls, parse_product_page, cache, parsers, follow_links=False)
+
+        all_pages = catalog_pages + product_pages
+        self._save_cache(all_pages)
+
+        errors = {page['url']: page['error'] for page in all_pages if page.get('error')}
+        not_modified = sum(1 for page in all_pages if page['status'] == 304)
+        print(f"📄 Страниц: {len(all_pages)}, без изменений: {not_modified}, ошибок: {len(errors)}")
+        print(f"📊 Найдено товаров: {len(products)}")
+
+        return {
+            'products': list(products.values()),
+            'total_products': len(products),
+            'product_pages': {page['url']: page['data'] for page in product_pages if page['data']},
+            'pages': len(all_pages),
+            'not_modified': not_modified,
+            'errors': errors,
+            'parsed_at': datetime.now().isoformat(),
+            # Страницы без единой карточки (заглушка, смена верстки) - не каталог
+            'success': bool(products)
+        }
+
+
+class FixtureHandler(BaseHTTPRequestHandler):
+    """Локальная замена сайта поставщика: отдает сохраненные HTML-фикстуры с ETag"""
+
+    catalog_file = 'site-html.txt'
+    product_file = 'debug_soup.html'
+
+    def do_GET(self):
+        path = urlsplit(self.path).path
+        # Страница товара заканчивается его ID: /catalog/.../2802
+        fixture = self.product_file if path.rstrip('/').split('/')[-1][:1].isdigit() else self.catalog_file
+        if not path.startswith('/catalog') or not os.path.exists(fixture):
+            self.send_error(404)
+            return
+
+        with open(fixture, 'rb') as f:
+            body = f.read()
+        etag = '"' + hashlib.md5(body).hexdigest() + '"'
+
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('ETag', etag)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve_fixtures(port=0):
+    """Запуск локального сервера фикстур в фоне; возвращает (сервер, базовый URL)"""
+    server = ThreadingHTTPServer(('127.0.0.1', port), FixtureHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f'http://127.0.0.1:{server.server_address[1]}'
+
+
+def main_crawl(start_urls, fetch_product_pages=False, images=False, image_origin=None, publish=False,
+               force_delist=False):
+    """Обход каталога и сохранение результата в базу.
+
+    images=True - затем скачать новые изображения товаров (image_origin -
+    подмена хоста картинок, например локальный serve_sample_images).
+    publish=True - обход, сохранение и изображения пишутся в копию базы,
+    которая после проверки атомарно заменяет текущую (publish.py).
+    force_delist=True - снять пропавшие товары, даже если их больше
+    половины каталога (при ошибках обхода снятие все равно пропускается).
+    Возвращает True, если каталог сохранен.
+    """
+    def crawl(db_name='iphones_catalog.db'):
+        crawler = CatalogCrawler(start_urls, db_name=db_name, fetch_product_pages=fetch_product_pages)
+        result = crawler.crawl()
+        # При ошибках обхода часть страниц не получена - пропавшие товары не снимаем
+        saved = result['success'] and iPhoneDatabase(db_name).save_catalog(
+            result, delist_missing=not result['errors'], force_delist=force_delist)
+        if not saved:
+            print("❌ Ошибка обхода каталога")
+            return False
+        print("💾 Каталог сохранен в базу данных")
+        if images:
+            ImagePipeline(db_name, origin=image_origin).run()
+        return True
+
+    if publish:
+        return publish_database(crawl, min_ratio=0 if force_delist else MIN_PRODUCTS_RATIO)
+    return crawl()
+
+
+if __name__ == "__main__":
+    # python crawler.py --local - обход локальных фикстур, иначе - переданные URL
+    # --images - скачать изображения товаров (с --local - с локального сервера картинок),
+    # --publish - собрать новую базу отдельно и атомарно заменить ею текущую,
+    # --force-delist - снять пропавшие товары, даже если пропало больше половины каталога
+    if '--local' in sys.argv:
+        server, base_url = serve_fixtures()
+        image_server, image_origin = serve_sample_images()
+        main_crawl(base_url + '/catalog/smartfony/iphone', fetch_product_pages='--products' in sys.argv,
+                   images='--images' in sys.argv, image_origin=image_origin, publish='--publish' in sys.argv,
+                   force_delist='--force-delist' in sys.argv)
+        image_server.shutdown()
+        server.shutdown()
+    else:
+        main_crawl([arg for arg in sys.argv[1:] if not arg.startswith('--')],
+                   fetch_product_pages='--products' in sys.argv, images='--images' in sys.argv,
+                   publish='--publish' in sys.argv, force_delist='--force-delist' in sys.argv)
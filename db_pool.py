@@ -0,0 +1,156 @@
+# db_pool.py
+import os
+import sqlite3
+import threading
+from urllib.request import pathname2url
+
+
+class ConnectionPool:
+    """Переиспользуемые соединения SQLite: одно соединение на поток.
+
+    Веб-процесс открывает базу только на чтение (URI mode=ro), настраивает
+    cache_size/mmap_size один раз на соединение, а кэш подготовленных
+    выражений модуля sqlite3 (cached_statements) переиспользуется между
+    запросами. Безопасно для многопоточного WSGI-сервера (gunicorn --threads):
+    соединение никогда не используется двумя потоками одновременно.
+
+    На read-only файловой системе (serverless) mode=ro не откроет базу в
+    режиме WAL: рядом нельзя создать -shm. Поэтому опубликованная база
+    всегда в режиме журнала DELETE (publish.py это проверяет), а на
+    файловой системе, смонтированной только на чтение, открывается с
+    immutable=1: без блокировок и журналов.
+    """
+
+    def __init__(self, db_path, read_only=True, immutable=None, cache_size=-16000,
+                 mmap_size=64 * 1024 * 1024, cached_statements=256, timeout=5.0,
+                 factory=sqlite3.Connection):
+        self.db_path = db_path
+        self.read_only = read_only
+        # immutable=1 - для read-only файловых систем (serverless), где нельзя создать -shm;
+        # None - включать, только если файловая система смонтирована на чтение
+        self.immutable = immutable
+        self.cache_size = cache_size
+        self.mmap_size = mmap_size
+        self.cached_statements = cached_statements
+        self.timeout = timeout
+        # Класс соединения (например, metrics.TimedConnection для замера запросов)
+        self.factory = factory
+
+        self._local = threading.local()
+        self._connections = set()
+        self._generation = 0
+        # Файл базы, с которым открыты соединения (см. check_replaced)
+        self._file_id = None
+        self._lock = threading.Lock()
+
+    def _is_immutable(self):
+        """Можно ли считать файл неизменным: задано явно или файловая система смонтирована только на чтение.
+
+        Права доступа не в счет: базу может менять другой пользователь
+        (парсер), и соединение с immutable=1 этих изменений не увидит.
+        """
+        if self.immutable is not None:
+            return self.immutable
+        if not hasattr(os, 'statvfs'):
+            return False
+        try:
+            return bool(os.statvfs(os.path.realpath(self.db_path)).f_flag & os.ST_RDONLY)
+        except OSError:
+            return False
+
+    def _uri(self):
+        """URI для открытия базы только на чтение"""
+        uri = 'file:' + pathname2url(os.path.abspath(self.db_path)) + '?mode=ro'
+        if self._is_immutable():
+            uri += '&immutable=1'
+        return uri
+
+    def _current_file_id(self):
+        """(устройство, inode) файла базы или None, если файла нет"""
+        try:
+            stat = os.stat(self.db_path)
+        except OSError:
+            return None
+        return (stat.st_dev, stat.st_ino)
+
+    def _connect(self):
+        """Открытие и настройка нового соединения"""
+        if self.read_only:
+            conn = sqlite3.connect(self._uri(), uri=True, timeout=self.timeout,
+                                   cached_statements=self.cached_statements,
+                                   check_same_thread=False, factory=self.factory)
+        else:
+            conn = sqlite3.connect(self.db_path, timeout=self.timeout,
+                                   cached_statements=self.cached_statements,
+                                   check_same_thread=False, factory=self.factory)
+
+        conn.row_factory = sqlite3.Row
+        conn.execute(f'PRAGMA cache_size = {int(self.cache_size)}')
+        conn.execute(f'PRAGMA mmap_size = {int(self.mmap_size)}')
+        if self.read_only:
+            conn.execute('PRAGMA query_only = 1')
+        return conn
+
+    def connection(self):
+        """Соединение текущего потока (создается при первом обращении)"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None and self._local.generation != self._generation:
+            # Пул сброшен через reset(): переоткрываем соединение этого потока
+            self.close()
+            conn = None
+
+        if conn is None:
+            file_id = self._current_file_id()
+            conn = self._connect()
+            self._local.conn = conn
+            self._local.generation = self._generation
+            with self._lock:
+                self._connections.add(conn)
+                if self._file_id is None:
+                    self._file_id = file_id
+        return conn
+
+    def check_replaced(self):
+        """Проверка, не заменен ли файл базы новым поколением (publish.py).
+
+        Открытые соединения продолжают читать старый файл; после замены пул
+        сбрасывается (reset), и каждый поток переоткрывает соединение при
+        следующем обращении. Возвращает True, если файл заменен.
+        """
+        file_id = self._current_file_id()
+        with self._lock:
+            if file_id is None or self._file_id is None or file_id == self._file_id:
+                return False
+            self._file_id = file_id
+            self._generation += 1
+            return True
+
+    def reset(self):
+        """Переоткрытие соединений всех потоков при их следующем обращении"""
+        with self._lock:
+            self._generation += 1
+
+    def close(self):
+        """Закрытие соединения текущего потока"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            self._local.conn = None
+            with self._lock:
+                self._connections.discard(conn)
+            conn.close()
+
+    def close_all(self):
+        """Закрытие всех соединений пула (при остановке процесса)"""
+        with self._lock:
+            connections = list(self._connections)
+            self._connections.clear()
+            self._generation += 1
+        for conn in connections:
+            conn.close()
+
+
+def enable_wal(conn):
+    """Перевод базы в режим WAL: читатели не блокируются записью парсера"""
+    mode = conn.execute('PRAGMA journal_mode = WAL').fetchone()[0]
+    conn.execute('PRAGMA synchronous = NORMAL')
+    return mode
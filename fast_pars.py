@@ -39,12 +39,13 @@ def quick_parse(html_content):
         'image': image_url
     }
 
-# Ваш HTML контент
-html_content = """
-<!-- вставьте сюда ваш сохраненный HTML -->
-"""
+if __name__ == "__main__":
+    # Ваш HTML контент
+    html_content = """
+    <!-- вставьте сюда ваш сохраненный HTML -->
+    """
 
-# Быстрый тест
-result = quick_parse(html_content)
-print("⚡ БЫСТРЫЙ РЕЗУЛЬТАТ:")
-print(json.dumps(result, ensure_ascii=False, indent=2))
\ No newline at end of file
+    # Быстрый тест
+    result = quick_parse(html_content)
+    print("⚡ БЫСТРЫЙ РЕЗУЛЬТАТ:")
+    print(json.dumps(result, ensure_ascii=False, indent=2))
\ No newline at end of file
@@ -0,0 +1,48 @@
+# fragment_cache.py
+from markupsafe import Markup
+
+from http_cache import LRUCache
+
+
+class FragmentCache:
+    """Кэш отрисованных фрагментов шаблонов (карточек товаров).
+
+    Ключ - (product_id, версия каталога, тип фрагмента): карточка зависит
+    только от товара, поэтому страница каталога собирается склейкой готовых
+    фрагментов, а шаблон на запрос рисует лишь общие части (корзина,
+    flash-сообщения). После перепарсинга старые ключи перестают совпадать
+    и вытесняются из LRU.
+
+    Фрагменты лежат в templates/fragments/<тип>.html и получают только
+    product и функции из context - без контекста запроса.
+    """
+
+    def __init__(self, jinja_env, snapshot_getter, maxsize=20000, context=None):
+        self.jinja_env = jinja_env
+        # Функция, возвращающая текущий снимок каталога (version_tag)
+        self.snapshot_getter = snapshot_getter
+        self.fragments = LRUCache(maxsize)
+        self.context = dict(context or {})
+
+    def _render(self, fragment, product):
+        template = self.jinja_env.get_template(f'fragments/{fragment}.html')
+        return Markup(template.render(product=product, **self.context))
+
+    def render(self, fragment, product, version_tag=None):
+        """Фрагмент для одного товара (из кэша или отрисованный)"""
+        if version_tag is None:
+            version_tag = self.snapshot_getter().version_tag
+        key = (product['product_id'], version_tag, fragment)
+        html = self.fragments.get(key)
+        if html is None:
+            html = self._render(fragment, product)
+            self.fragments.set(key, html)
+        return html
+
+    def render_many(self, fragment, products):
+        """Склейка фрагментов для списка товаров"""
+        version_tag = self.snapshot_getter().version_tag
+        return Markup('').join(self.render(fragment, product, version_tag) for product in products)
+
+    def clear(self):
+        self.fragments.clear()
@@ -0,0 +1,109 @@
+# http_cache.py
+import hashlib
+import threading
+from collections import OrderedDict
+from functools import wraps
+
+from flask import request, session, make_response
+
+
+class LRUCache:
+    """Потокобезопасный LRU-кэш ограниченного размера"""
+
+    def __init__(self, maxsize=256):
+        self.maxsize = maxsize
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._items.get(key)
+            if value is not None:
+                self._items.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+    def __len__(self):
+        return len(self._items)
+
+
+class HttpCache:
+    """HTTP-кэширование страниц и API каталога.
+
+    Версия каталога входит в ETag и ключ кэша, поэтому после перепарсинга
+    старые ответы просто перестают совпадать. Отвечает 304 на If-None-Match /
+    If-Modified-Since, выставляет Cache-Control для CDN и хранит готовые
+    ответы в LRU по маршруту и параметрам запроса.
+    """
+
+    def __init__(self, snapshot_getter, maxsize=256, max_age=60, s_maxage=300, user_key=None):
+        # Функция, возвращающая текущий снимок каталога (version_tag, last_modified)
+        self.snapshot_getter = snapshot_getter
+        # Функция, возвращающая данные сессии, от которых зависит страница (счетчик корзины)
+        self.user_key = user_key or (lambda: None)
+        self.responses = LRUCache(maxsize)
+        self.max_age = max_age
+        self.s_maxage = s_maxage
+
+    def _cache_control(self, response, per_user):
+        if per_user:
+            # Страница содержит данные сессии (счетчик корзины) - только для браузера
+            response.cache_control.private = True
+            response.cache_control.max_age = 0
+            response.cache_control.must_revalidate = True
+        else:
+            response.cache_control.public = True
+            response.cache_control.max_age = self.max_age
+            response.cache_control.s_maxage = self.s_maxage
+
+    def cached(self, per_user=False):
+        """Декоратор маршрута: ETag, условные GET и LRU готовых ответов.
+
+        per_user=True - для HTML-страниц, зависящих от сессии: счетчик
+        корзины входит в ключ, а страницы с flash-сообщениями не кэшируются.
+        """
+        def decorator(view):
+            @wraps(view)
+            def wrapper(*args, **kwargs):
+                if per_user and session.get('_flashes'):
+                    return view(*args, **kwargs)
+
+                snapshot = self.snapshot_getter()
+                key = (request.path, tuple(sorted(request.args.items(multi=True))))
+                if per_user:
+                    key += (self.user_key(),)
+
+                etag = hashlib.sha1(repr((snapshot.version_tag, key)).encode('utf-8')).hexdigest()
+
+                # Условный запрос: клиент или CDN уже имеет эту версию
+                if request.if_none_match.contains(etag):
+                    response = make_response('', 304)
+                else:
+                    cached = self.responses.get(key)
+                    if cached is not None and cached[0] == etag:
+                        response = make_response(cached[1])
+                        response.mimetype = cached[2]
+                    else:
+                        response = make_response(view(*args, **kwargs))
+                        if response.status_code != 200:
+                            # Ошибки (например, 404) не кэшируем
+                            return response
+                        self.responses.set(key, (etag, response.get_data(), response.mimetype))
+
+                response.set_etag(etag)
+                if snapshot.last_modified is not None:
+                    response.last_modified = snapshot.last_modified
+                self._cache_control(response, per_user)
+                return response.make_conditional(request)
+            return wrapper
+        return decorator
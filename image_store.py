@@ -0,0 +1,317 @@
+# image_store.py
+import hashlib
+import io
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, urlunsplit
+
+import requests
+
+from migrations import migrate
+
+try:
+    from PIL import Image
+except ImportError:
+    # Pillow не установлен (он в requirements.txt) - изображения не обрабатываются,
+    # шаблоны показывают картинки с сайта поставщика
+    Image = None
+
+# Размеры копий: наибольшая сторона в пикселях (с запасом для экранов 2x)
+SIZES = {
+    'thumb': 160,
+    'card': 480,
+    'detail': 1000,
+}
+
+# Форматы копий: (формат Pillow, MIME-тип, расширение файла, параметры сохранения)
+FORMATS = {
+    'webp': ('WEBP', 'image/webp', '.webp', {'quality': 80, 'method': 4}),
+    'jpeg': ('JPEG', 'image/jpeg', '.jpg', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+
+MIME_TYPES = {'jpeg': 'image/jpeg', 'webp': 'image/webp', 'png': 'image/png'}
+EXTENSIONS = {'jpeg': '.jpg', 'webp': '.webp', 'png': '.png'}
+
+
+class ImageStore:
+    """Content-addressed хранилище файлов изображений с LRU по размеру.
+
+    Файл называется по sha256 содержимого, поэтому одинаковые картинки
+    хранятся один раз, а URL с хэшем можно кэшировать бессрочно. Время
+    последнего обращения - mtime файла: при отдаче он обновляется, а при
+    превышении max_bytes удаляются самые давние файлы.
+    """
+
+    def __init__(self, root='image_cache', max_bytes=512 * 1024 * 1024):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+
+    def path(self, digest, extension):
+        return os.path.join(self.root, digest[:2], digest + extension)
+
+    def put(self, data, extension):
+        """Сохранение файла (атомарно); возвращает его хэш"""
+        digest = hashlib.sha256(data).hexdigest()
+        path = self.path(digest, extension)
+        if os.path.exists(path):
+            os.utime(path)
+            return digest
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(temp_path, path)
+        return digest
+
+    def open(self, digest, extension):
+        """Путь к файлу с отметкой обращения или None, если файл вытеснен"""
+        path = self.path(digest, extension)
+        try:
+            os.utime(path)
+        except OSError:
+            return None
+        return path
+
+    def evict(self):
+        """Удаление давно не запрошенных файлов сверх max_bytes; возвращает хэши удаленных"""
+        with self._lock:
+            files = []
+            total = 0
+            for directory, _, names in os.walk(self.root):
+                for name in names:
+                    path = os.path.join(directory, name)
+                    try:
+                        stat = os.stat(path)
+                    except OSError:
+                        continue
+                    files.append((stat.st_mtime, stat.st_size, path))
+                    total += stat.st_size
+
+            removed = set()
+            for _, size, path in sorted(files):
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                except OSError:
+                    continue
+                total -= size
+                removed.add(os.path.basename(path).split('.')[0])
+            return removed
+
+
+def make_variants(data):
+    """Уменьшенные копии: {(размер, формат): байты} (нужен Pillow)"""
+    with Image.open(io.BytesIO(data)) as source:
+        source.load()
+        if source.mode not in ('RGB', 'RGBA'):
+            source = source.convert('RGBA' if 'transparency' in source.info else 'RGB')
+
+        variants = {}
+        for size, max_side in SIZES.items():
+            image = source.copy()
+            # Только уменьшаем: маленькие оригиналы не растягиваем
+            image.thumbnail((max_side, max_side), Image.LANCZOS)
+            for image_format, (pil_format, _, _, options) in FORMATS.items():
+                frame = image
+                if pil_format == 'JPEG' and image.mode == 'RGBA':
+                    # В JPEG нет прозрачности - подкладываем белый фон
+                    frame = Image.new('RGB', image.size, (255, 255, 255))
+                    frame.paste(image, mask=image.getchannel('A'))
+                buffer = io.BytesIO()
+                frame.save(buffer, pil_format, **options)
+                variants[(size, image_format)] = buffer.getvalue()
+        return variants
+
+
+def load_product_images(conn):
+    """Обработанные изображения для снимка каталога.
+
+    {product_id: {'version': хэш оригинала, размер: {формат: хэш файла}}};
+    пустой словарь, если изображения еще не обрабатывались.
+    """
+    try:
+        rows = conn.execute(
+            'SELECT product_id, size, format, digest, source_digest FROM product_images'
+        ).fetchall()
+    except sqlite3.OperationalError:
+        # База без таблицы product_images
+        return {}
+
+    images = {}
+    for product_id, size, image_format, digest, source_digest in rows:
+        product = images.setdefault(product_id, {'version': source_digest[:16]})
+        product.setdefault(size, {})[image_format] = digest
+    return images
+
+
+class ImagePipeline:
+    """Загрузка изображений товаров при сохранении каталога.
+
+    Каждый image_url скачивается один раз: товары, у которых адрес картинки
+    не менялся с прошлого прогона, пропускаются. Копии, вытесненные из
+    хранилища по LRU, забываются и при следующем прогоне скачиваются заново.
+    origin - подмена хоста картинок (локальная замена сайта поставщика в тестах).
+    """
+
+    def __init__(self, db_name='iphones_catalog.db', store=None, max_workers=8, timeout=15, origin=None):
+        self.db_name = db_name
+        self.store = store or ImageStore()
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.origin = origin
+        self.session = requests.Session()
+
+    def _source_url(self, image_url):
+        if not self.origin:
+            return image_url
+        base = urlsplit(self.origin)
+        url = urlsplit(image_url)
+        return urlunsplit((base.scheme, base.netloc, url.path, url.query, ''))
+
+    def _process(self, product_id, image_url):
+        """Скачивание и нарезка одного изображения (в пуле потоков)"""
+        try:
+            response = self.session.get(self._source_url(image_url), timeout=self.timeout)
+            response.raise_for_status()
+            data = response.content
+            rows = []
+            for (size, image_format), variant in make_variants(data).items():
+                digest = self.store.put(variant, EXTENSIONS[image_format])
+                rows.append((product_id, size, image_format, digest, len(variant),
+                             image_url, hashlib.sha256(data).hexdigest()))
+            return rows, None
+        except Exception as e:
+            return [], f'{image_url}: {e}'
+
+    def run(self, force=False):
+        """Обработка изображений всех товаров в продаже; возвращает число обработанных"""
+        # parsing сам импортирует этот модуль - импорт здесь, а не в начале файла
+        from parsing import bump_catalog_version
+
+        conn = sqlite3.connect(self.db_name)
+        migrate(conn)
+        cursor = conn.cursor()
+
+        # Оригиналы, сохраненные прежними версиями вместо копий (без Pillow):
+        # забываем - с Pillow они будут нарезаны заново, без него шаблоны
+        # вернутся к картинкам поставщика, а не к полноразмерным файлам через /img
+        cursor.execute('''
+            DELETE FROM product_images WHERE product_id IN (
+                SELECT product_id FROM product_images WHERE digest = source_digest
+            )
+        ''')
+        originals = cursor.rowcount
+
+        if Image is None:
+            print("⚠️ Pillow не установлен - уменьшенные копии изображений не делаются (pip install Pillow)")
+            if originals:
+                bump_catalog_version(cursor)
+            conn.commit()
+            conn.close()
+            return 0
+
+        # Товары, у которых еще нет копий или сменился адрес картинки
+        pending = cursor.execute('''
+            SELECT c.product_id, c.image_url FROM iphones_catalog c
+            WHERE c.image_url IS NOT NULL AND c.image_url != '' AND NOT c.is_delisted
+              AND (? OR NOT EXISTS (
+                  SELECT 1 FROM product_images i
+                  WHERE i.product_id = c.product_id AND i.source_url = c.image_url
+              ))
+        ''', (force,)).fetchall()
+
+        processed = 0
+        if pending:
+            print(f"🖼 Обработка изображений: {len(pending)}")
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            for rows, error in executor.map(lambda item: self._process(*item), pending):
+                if error:
+                    print(f"❌ Ошибка изображения {error}")
+                    continue
+                cursor.execute('DELETE FROM product_images WHERE product_id = ?', (rows[0][0],))
+                cursor.executemany('INSERT INTO product_images VALUES (?, ?, ?, ?, ?, ?, ?)', rows)
+                processed += 1
+
+        # Товары с вытесненными файлами снова отдают оригинал, пока их не скачают заново
+        removed = self.store.evict()
+        forgotten = set()
+        if removed:
+            cursor.execute('CREATE TEMP TABLE IF NOT EXISTS evicted_images (digest TEXT PRIMARY KEY)')
+            cursor.execute('DELETE FROM evicted_images')
+            cursor.executemany('INSERT INTO evicted_images VALUES (?)', ((digest,) for digest in removed))
+            forgotten = {row[0] for row in cursor.execute(
+                'SELECT DISTINCT product_id FROM product_images WHERE digest IN (SELECT digest FROM evicted_images)'
+            )}
+            cursor.executemany('DELETE FROM product_images WHERE product_id = ?', ((pid,) for pid in forgotten))
+
+        if processed or forgotten or originals:
+            # Адреса картинок входят в снимок каталога веб-приложения
+            bump_catalog_version(cursor)
+        conn.commit()
+        conn.close()
+
+        if pending or removed:
+            print(f"🖼 Изображений обработано: {processed}, вытеснено файлов: {len(removed)}")
+        return processed
+
+
+# Минимальный JPEG 1x1 - если Pillow нет и сгенерировать пример нельзя
+SAMPLE_JPEG = bytes.fromhex(
+    'ffd8ffe000104a46494600010100000100010000ffdb004300080606070605080707070909080a0c140d0c0b0b0c1912130f'
+    '141d1a1f1e1d1a1c1c20242e2720222c231c1c2837292c30313434341f27393d38323c2e333432ffc0000b08000100010101'
+    '1100ffc4001f0000010501010101010100000000000000000102030405060708090a0bffc400b5100002010303020403050504'
+    '040000017d01020300041105122131410613516107227114328191a1082342b1c11552d1f02433627282090a161718191a2526'
+    '2728292a3435363738393a434445464748494a535455565758595a636465666768696a737475767778797a838485868788898a'
+    '92939495969798999aa2a3a4a5a6a7a8a9aab2b3b4b5b6b7b8b9bac2c3c4c5c6c7c8c9cad2d3d4d5d6d7d8d9dae1e2e3e4e5e6'
+    'e7e8e9eaf1f2f3f4f5f6f7f8f9faffda0008010100003f00fbd3ffd9'
+)
+
+
+def sample_image(path, size=1200):
+    """Пример изображения для локальной замены сайта (цвет зависит от пути)"""
+    if Image is None:
+        return SAMPLE_JPEG
+    color = tuple(hashlib.md5(path.encode('utf-8')).digest()[:3])
+    buffer = io.BytesIO()
+    Image.new('RGB', (size, size), color).save(buffer, 'JPEG', quality=90)
+    return buffer.getvalue()
+
+
+class SampleImageHandler(BaseHTTPRequestHandler):
+    """Локальная замена хоста картинок поставщика: JPEG на любой путь"""
+
+    def do_GET(self):
+        body = sample_image(urlsplit(self.path).path)
+        self.send_response(200)
+        self.send_header('Content-Type', 'image/jpeg')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve_sample_images(port=0):
+    """Запуск локального сервера картинок в фоне; возвращает (сервер, базовый URL)"""
+    server = ThreadingHTTPServer(('127.0.0.1', port), SampleImageHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f'http://127.0.0.1:{server.server_address[1]}'
+
+
+if __name__ == "__main__":
+    # python image_store.py [--local] [--force] - обработка изображений каталога
+    server = None
+    origin = None
+    if '--local' in sys.argv:
+        server, origin = serve_sample_images()
+    ImagePipeline(origin=origin).run(force='--force' in sys.argv)
+    if server is not None:
+        server.shutdown()
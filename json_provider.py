@@ -0,0 +1,55 @@
+# json_provider.py
+from collections.abc import Mapping
+
+from flask.json.provider import DefaultJSONProvider
+
+import json
+
+try:
+    import orjson
+except ImportError:
+    # orjson не установлен - работаем на стандартном json
+    orjson = None
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """JSON-провайдер Flask с быстрым бэкендом orjson (если установлен).
+
+    Ответы в обоих случаях компактные (без пробелов после разделителей),
+    в UTF-8 без \\uXXXX и с сортированными ключами - как у orjson, поэтому
+    размер и содержимое ответов (и их ETag) от бэкенда не зависят.
+    """
+
+    @staticmethod
+    def default(o):
+        if isinstance(o, Mapping):
+            return dict(o)
+        return DefaultJSONProvider.default(o)
+
+    def dumps_bytes(self, obj):
+        """Сериализация сразу в байты UTF-8 (для готовых ответов)"""
+        if orjson is not None:
+            return orjson.dumps(obj, default=self.default, option=orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS)
+        return json.dumps(obj, default=self.default, sort_keys=True, separators=(',', ':'),
+                          ensure_ascii=False).encode('utf-8')
+
+    def dumps(self, obj, **kwargs):
+        if orjson is not None and not kwargs:
+            return self.dumps_bytes(obj).decode('utf-8')
+        return super().dumps(obj, **kwargs)
+
+    def loads(self, s, **kwargs):
+        if orjson is not None and not kwargs:
+            return orjson.loads(s)
+        return super().loads(s, **kwargs)
+
+    def response(self, *args, **kwargs):
+        # В отладке - стандартный форматированный вывод
+        if self.compact is False or (self.compact is None and self._app.debug):
+            return super().response(*args, **kwargs)
+        obj = self._prepare_response_obj(args, kwargs)
+        return self.bytes_response(self.dumps_bytes(obj))
+
+    def bytes_response(self, payload):
+        """Ответ из уже сериализованных байтов"""
+        return self._app.response_class(payload, mimetype=self.mimetype)
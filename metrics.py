@@ -0,0 +1,309 @@
+# metrics.py
+import cProfile
+import hmac
+import os
+import random
+import re
+import sqlite3
+import threading
+import time
+from bisect import bisect_left
+from datetime import datetime
+
+from flask import abort, g, has_request_context, request, template_rendered, before_render_template
+
+# Границы корзин гистограмм задержки (секунды), как у клиентов Prometheus
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Адреса, с которых /metrics доступен без токена
+LOOPBACK_ADDRS = ('127.0.0.1', '::1')
+
+# Пробелы в тексте SQL схлопываются - метка запроса не зависит от форматирования
+WHITESPACE_RE = re.compile(r'\s+')
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    pairs += [f'{name}="{value}"' for name, value in extra]
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Histogram:
+    """Гистограмма в формате Prometheus (накопительные корзины, сумма, количество)"""
+
+    def __init__(self, name, help_text, label_names=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * len(self.buckets), 0.0, 0]
+            position = bisect_left(self.buckets, value)
+            if position < len(self.buckets):
+                series[0][position] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            series = {labels: (list(counts), total, count) for labels, (counts, total, count) in self._series.items()}
+        for label_values, (counts, total, count) in sorted(series.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                labels = _labels(self.label_names, label_values, [('le', repr(bound))])
+                lines.append(f'{self.name}_bucket{labels} {cumulative}')
+            labels = _labels(self.label_names, label_values, [('le', '+Inf')])
+            lines.append(f'{self.name}_bucket{labels} {count}')
+            labels = _labels(self.label_names, label_values)
+            lines.append(f'{self.name}_sum{labels} {total}')
+            lines.append(f'{self.name}_count{labels} {count}')
+        return lines
+
+
+class Counter:
+    """Счетчик в формате Prometheus"""
+
+    def __init__(self, name, help_text, label_names=()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount, *label_values):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} counter']
+        with self._lock:
+            values = dict(self._values)
+        for label_values, value in sorted(values.items()):
+            lines.append(f'{self.name}{_labels(self.label_names, label_values)} {value}')
+        return lines
+
+
+class FetchedCursor:
+    """Результат запроса, уже выбранный целиком (для замера строк и времени)"""
+
+    def __init__(self, cursor, rows):
+        self.description = cursor.description
+        self.rowcount = cursor.rowcount
+        self.lastrowid = cursor.lastrowid
+        self._rows = rows
+        self._position = 0
+
+    def fetchone(self):
+        if self._position >= len(self._rows):
+            return None
+        self._position += 1
+        return self._rows[self._position - 1]
+
+    def fetchmany(self, size=1):
+        rows = self._rows[self._position:self._position + size]
+        self._position += len(rows)
+        return rows
+
+    def fetchall(self):
+        rows = self._rows[self._position:]
+        self._position = len(self._rows)
+        return rows
+
+    def __iter__(self):
+        while self._position < len(self._rows):
+            self._position += 1
+            yield self._rows[self._position - 1]
+
+
+class TimedConnection(sqlite3.Connection):
+    """Соединение SQLite, замеряющее каждый execute: время до последней строки и число строк.
+
+    Используется как factory для sqlite3.connect (ConnectionPool(factory=...)).
+    Результат выбирается сразу, поэтому подходит только для запросов на
+    чтение веб-процесса, которые и так читают результат целиком.
+    """
+
+    # Функция (sql, секунды, строки), назначается Instrumentation
+    recorder = None
+
+    def execute(self, sql, parameters=()):
+        started = time.perf_counter()
+        cursor = super().execute(sql, parameters)
+        rows = cursor.fetchall()
+        if self.recorder is not None:
+            self.recorder(sql, time.perf_counter() - started, len(rows))
+        return FetchedCursor(cursor, rows)
+
+
+class Instrumentation:
+    """Метрики веб-приложения: время маршрутов, SQL, шаблонов и JSON.
+
+    - гистограммы в формате Prometheus отдаются на /metrics;
+    - запросы SQL текущего HTTP-запроса копятся в g.sql_queries и вместе
+      с остальным временем уходят в заголовок Server-Timing;
+    - profile_slow_ms > 0 включает cProfile для доли profile_sample_rate
+      запросов и сохраняет статистику тех, что медленнее порога, в profile_dir.
+    """
+
+    def __init__(self, app=None, profile_slow_ms=0, profile_sample_rate=1.0, profile_dir='profiles',
+                 metrics_token=None):
+        self.profile_slow_ms = profile_slow_ms
+        self.profile_sample_rate = profile_sample_rate
+        self.profile_dir = profile_dir
+        # /metrics раскрывает тексты SQL и задержки маршрутов: с токеном - только
+        # по нему (Authorization: Bearer), без токена - только с loopback
+        self.metrics_token = metrics_token
+
+        self.request_duration = Histogram(
+            'http_request_duration_seconds', 'Время обработки HTTP-запроса', ('route', 'method', 'status'))
+        self.sql_duration = Histogram(
+            'sql_query_duration_seconds', 'Время выполнения SQL-запроса (включая выборку строк)', ('query',))
+        self.sql_rows = Counter('sql_query_rows_total', 'Строк возвращено SQL-запросами', ('query',))
+        self.template_duration = Histogram(
+            'template_render_duration_seconds', 'Время отрисовки шаблона', ('template',))
+        self.json_duration = Histogram('json_encode_duration_seconds', 'Время сериализации JSON-ответа')
+        self.metrics = (self.request_duration, self.sql_duration, self.sql_rows,
+                        self.template_duration, self.json_duration)
+
+        # Профилировщик один на процесс: cProfile не допускает параллельных сессий
+        self._profiler_lock = threading.Lock()
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        app.teardown_request(self._teardown_request)
+        before_render_template.connect(self._before_render, app)
+        template_rendered.connect(self._after_render, app)
+        self._instrument_json(app.json)
+        TimedConnection.recorder = self.record_sql
+        app.add_url_rule('/metrics', 'metrics', self.metrics_view)
+
+    def _instrument_json(self, provider):
+        """Замер сериализации JSON (и jsonify, и готовых ответов API)"""
+        encode = getattr(provider, 'dumps_bytes', None) or provider.dumps
+
+        def timed_encode(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return encode(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - started
+                self.json_duration.observe(elapsed)
+                if has_request_context():
+                    g.json_time = g.get('json_time', 0.0) + elapsed
+
+        if hasattr(provider, 'dumps_bytes'):
+            provider.dumps_bytes = timed_encode
+        else:
+            provider.dumps = timed_encode
+
+    def record_sql(self, sql, seconds, rows):
+        query = WHITESPACE_RE.sub(' ', sql).strip()
+        self.sql_duration.observe(seconds, query)
+        self.sql_rows.inc(rows, query)
+        if has_request_context():
+            g.setdefault('sql_queries', []).append((query, seconds, rows))
+
+    def _before_render(self, sender, template, context, **extra):
+        g.setdefault('template_starts', []).append(time.perf_counter())
+
+    def _after_render(self, sender, template, context, **extra):
+        starts = g.get('template_starts')
+        if starts:
+            elapsed = time.perf_counter() - starts.pop()
+            self.template_duration.observe(elapsed, template.name or '<string>')
+            # Вложенные шаблоны (include) входят в родительский - считаем только внешний
+            if not starts:
+                g.template_time = g.get('template_time', 0.0) + elapsed
+
+    def _before_request(self):
+        g.request_started = time.perf_counter()
+        if self.profile_slow_ms > 0 and random.random() < self.profile_sample_rate:
+            if self._profiler_lock.acquire(blocking=False):
+                g.profiler = cProfile.Profile()
+                g.profiler.enable()
+
+    def _route(self):
+        return request.url_rule.rule if request.url_rule is not None else '<unmatched>'
+
+    def _finish(self, status):
+        """Учет завершенного запроса; возвращает его длительность (или None, если уже учтен)"""
+        started = g.pop('request_started', None)
+        if started is None:
+            return None
+        elapsed = time.perf_counter() - started
+        self.request_duration.observe(elapsed, self._route(), request.method, str(status))
+
+        profiler = g.pop('profiler', None)
+        if profiler is not None:
+            profiler.disable()
+            self._profiler_lock.release()
+            if elapsed * 1000 >= self.profile_slow_ms:
+                self._dump_profile(profiler, elapsed)
+        return elapsed
+
+    def _after_request(self, response):
+        elapsed = self._finish(response.status_code)
+        if elapsed is not None:
+            queries = g.get('sql_queries', ())
+            timings = [f'total;dur={elapsed * 1000:.2f}']
+            if queries:
+                sql_time = sum(seconds for _, seconds, _ in queries)
+                timings.append(f'sql;dur={sql_time * 1000:.2f};desc="{len(queries)} queries"')
+            if 'template_time' in g:
+                timings.append(f'template;dur={g.template_time * 1000:.2f}')
+            if 'json_time' in g:
+                timings.append(f'json;dur={g.json_time * 1000:.2f}')
+            response.headers['Server-Timing'] = ', '.join(timings)
+        return response
+
+    def _teardown_request(self, exc):
+        # after_request не вызывается при необработанном исключении
+        if exc is not None:
+            self._finish(500)
+
+    def _dump_profile(self, profiler, elapsed):
+        """Сохранение статистики cProfile медленного запроса (.prof для snakeviz/pstats)"""
+        os.makedirs(self.profile_dir, exist_ok=True)
+        route = re.sub(r'\W+', '_', self._route()).strip('_') or 'root'
+        name = f"{datetime.now():%Y%m%d_%H%M%S_%f}_{route}_{elapsed * 1000:.0f}ms.prof"
+        path = os.path.join(self.profile_dir, name)
+        profiler.dump_stats(path)
+
+        print(f"🐢 Медленный запрос {request.method} {request.full_path}: {elapsed * 1000:.0f} мс, профиль: {path}")
+        for query, seconds, rows in g.get('sql_queries', ()):
+            print(f"   SQL {seconds * 1000:.2f} мс, строк {rows}: {query[:120]}")
+
+    def render(self):
+        """Все метрики в текстовом формате Prometheus"""
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+    def _metrics_allowed(self):
+        if self.metrics_token:
+            auth = request.headers.get('Authorization', '')
+            return hmac.compare_digest(auth.encode('utf-8'), f'Bearer {self.metrics_token}'.encode('utf-8'))
+        # За обратным прокси на той же машине все запросы приходят с loopback - там нужен токен
+        return request.remote_addr in LOOPBACK_ADDRS
+
+    def metrics_view(self):
+        if not self._metrics_allowed():
+            abort(404)
+        return self.render(), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
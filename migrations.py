@@ -0,0 +1,233 @@
+# migrations.py
+import sqlite3
+import sys
+
+from read_model import create_read_model, refresh_read_model
+
+
+def _add_column(cursor, table, column, definition):
+    """Добавление колонки, если ее еще нет (базы, измененные вручную до миграций)"""
+    columns = {row[1] for row in cursor.execute(f'PRAGMA table_info({table})')}
+    if column not in columns:
+        cursor.execute(f'ALTER TABLE {table} ADD COLUMN {column} {definition}')
+
+
+def _base_schema(cursor):
+    """Таблицы каталога и вариантов товара"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS iphones_catalog (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            product_id TEXT UNIQUE,
+            model TEXT NOT NULL,
+            price INTEGER DEFAULT 0,
+            currency TEXT DEFAULT 'RUB',
+            old_price TEXT,
+            current_color TEXT,
+            current_memory TEXT,
+            current_sim TEXT,
+            image_url TEXT,
+            product_url TEXT,
+            parsed_at DATETIME,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+    for table, column in (
+        ('iphone_catalog_colors', 'color_name'),
+        ('iphone_catalog_memory', 'memory_size'),
+        ('iphone_catalog_sim', 'sim_type'),
+    ):
+        cursor.execute(f'''
+            CREATE TABLE IF NOT EXISTS {table} (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                product_id TEXT,
+                {column} TEXT,
+                FOREIGN KEY (product_id) REFERENCES iphones_catalog (product_id)
+            )
+        ''')
+        # Покрывающий индекс: варианты товара и сверка при пакетном сохранении
+        cursor.execute(f'CREATE INDEX IF NOT EXISTS idx_{table}_product ON {table} (product_id, {column})')
+
+
+def _web_columns(cursor):
+    """Поля веб-отображения (раньше добавлялись в web_db_setup)"""
+    _add_column(cursor, 'iphones_catalog', 'display_order', 'INTEGER DEFAULT 0')
+    _add_column(cursor, 'iphones_catalog', 'is_featured', 'BOOLEAN DEFAULT 0')
+    _add_column(cursor, 'iphones_catalog', 'category', "TEXT DEFAULT 'iPhone'")
+
+
+def _change_tracking(cursor):
+    """Хэши карточек, снятие с продажи и история цен"""
+    _add_column(cursor, 'iphones_catalog', 'content_hash', 'TEXT')
+    _add_column(cursor, 'iphones_catalog', 'is_delisted', 'INTEGER DEFAULT 0')
+    _add_column(cursor, 'iphones_catalog', 'delisted_at', 'DATETIME')
+
+    # История цен: только изменения, время - unix-секунды, цена - целые рубли.
+    # WITHOUT ROWID хранит строки прямо в порядке (product_id, ts), поэтому
+    # выборка истории товара за период - один диапазонный проход по ключу.
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS iphone_price_history (
+            product_id TEXT NOT NULL,
+            ts INTEGER NOT NULL,
+            price INTEGER NOT NULL,
+            PRIMARY KEY (product_id, ts)
+        ) WITHOUT ROWID
+    ''')
+
+
+def _catalog_indexes(cursor):
+    """Покрывающие индексы под выборки каталога (см. QUERY_SHAPES)"""
+    for name, columns in (
+        ('category_price', 'category, price, product_id'),
+        ('category_order', 'category, display_order, product_id'),
+        ('featured_price', 'is_featured, price, product_id'),
+        ('price', 'price, product_id'),
+        ('display_order', 'display_order, product_id'),
+        ('parsed_at', 'parsed_at'),
+    ):
+        cursor.execute(f'CREATE INDEX IF NOT EXISTS idx_iphones_catalog_{name} ON iphones_catalog ({columns})')
+
+
+def _read_model(cursor):
+    """Витрина catalog_read_model с готовыми для веба товарами"""
+    create_read_model(cursor)
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_catalog_read_model_category ON catalog_read_model (category, display_order)')
+    # Заполнение из уже сохраненного каталога
+    refresh_read_model(cursor)
+
+
+def _product_images(cursor):
+    """Уменьшенные копии изображений товаров (см. image_store)"""
+    # digest - имя файла в ImageStore, source_digest - хэш скачанного оригинала
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS product_images (
+            product_id TEXT NOT NULL,
+            size TEXT NOT NULL,
+            format TEXT NOT NULL,
+            digest TEXT NOT NULL,
+            bytes INTEGER,
+            source_url TEXT,
+            source_digest TEXT,
+            PRIMARY KEY (product_id, size, format)
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_product_images_digest ON product_images (digest)')
+
+
+def _catalog_meta(cursor):
+    """Служебные значения каталога (версия для снимков веб-приложения)"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS catalog_meta (
+            key TEXT PRIMARY KEY,
+            value INTEGER
+        )
+    ''')
+
+
+def _crawl_pages(cursor):
+    """Кэш условных запросов обходчика (см. crawler)"""
+    # Валидаторы (ETag / Last-Modified) и результат разбора каждой страницы
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS crawl_pages (
+            url TEXT PRIMARY KEY,
+            etag TEXT,
+            last_modified TEXT,
+            data TEXT,
+            links TEXT,
+            fetched_at DATETIME
+        )
+    ''')
+
+
+# Миграции по порядку: номер в списке + 1 = PRAGMA user_version после применения.
+# Уже выпущенные миграции не меняются - только добавляются новые в конец.
+MIGRATIONS = (
+    _base_schema,
+    _web_columns,
+    _change_tracking,
+    _catalog_indexes,
+    _read_model,
+    _product_images,
+    _catalog_meta,
+    _crawl_pages,
+)
+
+# Типовые запросы к каталогу: каждый должен выполняться по индексу
+QUERY_SHAPES = {
+    'product_by_id': ('SELECT * FROM iphones_catalog WHERE product_id = ?', ('1',)),
+    'category_by_price': ('SELECT product_id FROM iphones_catalog WHERE category = ? ORDER BY price DESC', ('iPhone',)),
+    'category_by_order': ('SELECT product_id FROM iphones_catalog WHERE category = ? ORDER BY display_order', ('iPhone',)),
+    'featured_by_price': ('SELECT product_id FROM iphones_catalog WHERE is_featured = 1 ORDER BY price DESC', ()),
+    'top_by_price': ('SELECT product_id FROM iphones_catalog ORDER BY price DESC LIMIT 10', ()),
+    'all_by_order': ('SELECT product_id FROM iphones_catalog ORDER BY display_order', ()),
+    'catalog_version': ('SELECT MAX(parsed_at), COUNT(*) FROM iphones_catalog', ()),
+    'product_colors': ('SELECT color_name FROM iphone_catalog_colors WHERE product_id = ?', ('1',)),
+    'product_memory': ('SELECT memory_size FROM iphone_catalog_memory WHERE product_id = ?', ('1',)),
+    'product_sim': ('SELECT sim_type FROM iphone_catalog_sim WHERE product_id = ?', ('1',)),
+    'read_model_by_id': ('SELECT data FROM catalog_read_model WHERE product_id = ?', ('1',)),
+    'read_model_category': (
+        'SELECT data FROM catalog_read_model WHERE category = ? ORDER BY display_order', ('iPhone',)
+    ),
+    'price_history': (
+        'SELECT ts, price FROM iphone_price_history WHERE product_id = ? AND ts >= ? ORDER BY ts', ('1', 0)
+    ),
+}
+
+
+def schema_version(conn):
+    """Текущая версия схемы (PRAGMA user_version)"""
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+
+def migrate(conn):
+    """Применение недостающих миграций; возвращает итоговую версию схемы.
+
+    Каждая миграция выполняется в своей транзакции вместе с записью новой
+    версии. После изменений схемы обновляется статистика планировщика (ANALYZE).
+    """
+    conn.commit()
+    version = schema_version(conn)
+    for number, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+        cursor = conn.cursor()
+        try:
+            cursor.execute('BEGIN')
+            migration(cursor)
+            cursor.execute(f'PRAGMA user_version = {number}')
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        print(f"🛠 Миграция {number}: {migration.__doc__}")
+
+    if version < len(MIGRATIONS):
+        conn.execute('ANALYZE')
+        conn.commit()
+    return schema_version(conn)
+
+
+def check_query_plans(conn):
+    """Запросы из QUERY_SHAPES, которые выполняются без индекса.
+
+    Возвращает {имя: шаги плана}; пустой словарь - все запросы идут по индексам.
+    """
+    problems = {}
+    for name, (sql, params) in QUERY_SHAPES.items():
+        details = [row[3] for row in conn.execute('EXPLAIN QUERY PLAN ' + sql, params)]
+        bad = [detail for detail in details
+               if (detail.startswith('SCAN') and 'INDEX' not in detail) or 'TEMP B-TREE' in detail]
+        if bad:
+            problems[name] = details
+    return problems
+
+
+if __name__ == "__main__":
+    # python migrations.py [база] - миграция и проверка планов запросов
+    conn = sqlite3.connect(sys.argv[1] if len(sys.argv) > 1 else 'iphones_catalog.db')
+    print(f"📦 Версия схемы: {migrate(conn)}")
+    problems = check_query_plans(conn)
+    for name, details in problems.items():
+        print(f"❌ {name}: {'; '.join(details)}")
+    if not problems:
+        print(f"✅ Все {len(QUERY_SHAPES)} типовых запросов используют индексы")
+    conn.close()
+    sys.exit(1 if problems else 0)
@@ -1,15 +1,41 @@
 import requests
 from bs4 import BeautifulSoup
+import contextlib
+import hashlib
+import itertools
+import os
 import sqlite3
+import sys
 import json
 import re
 from datetime import datetime
 
+from categorize import RuleEngine, apply_rules
+from db_pool import enable_wal
+from image_store import ImagePipeline
+from migrations import migrate
+from publish import MIN_PRODUCTS_RATIO, publish_database
+from read_model import refresh_read_model
+
+try:
+    from lxml import etree, html as lxml_html
+    # Все div с классом card (карточки товаров) - выражение компилируется один раз
+    CARD_XPATH = etree.XPath("//div[contains(concat(' ', normalize-space(@class), ' '), ' card ')]")
+except ImportError:
+    lxml_html = None
+
 class IPhoneCatalogParser:
-    def __init__(self):
+    def __init__(self, parser='lxml', debug_dump=False):
         self.headers = {
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',
         }
+        # 'lxml' - быстрый разбор lxml, 'html.parser' - BeautifulSoup
+        if parser == 'lxml' and lxml_html is None:
+            print("⚠️ lxml не установлен, используем html.parser")
+            parser = 'html.parser'
+        self.parser = parser
+        # Сохранять ли разобранный HTML в debug_catalog.html
+        self.debug_dump = debug_dump
     
     def parse_catalog_html(self, html_content):
         """Парсинг HTML страницы каталога iPhone"""
@@ -19,15 +45,27 @@ class IPhoneCatalogParser:
             print("❌ HTML слишком короткий или пустой")
             return {'success': False, 'error': 'Empty HTML'}
         
-        soup = BeautifulSoup(html_content, 'html.parser')
-        
-        # Сохраним HTML для отладки
-        with open('debug_catalog.html', 'w', encoding='utf-8') as f:
-            f.write(soup.prettify())
-        print("💾 Каталог HTML сохранен в debug_catalog.html")
-        
-        # Ищем все карточки товаров
-        products = self._extract_products(soup)
+        if self.parser == 'lxml':
+            tree = lxml_html.document_fromstring(html_content)
+            
+            # Сохраним HTML для отладки
+            if self.debug_dump:
+                with open('debug_catalog.html', 'w', encoding='utf-8') as f:
+                    f.write(etree.tostring(tree, pretty_print=True, method='html', encoding='unicode'))
+                print("💾 Каталог HTML сохранен в debug_catalog.html")
+            
+            products = self._extract_products_lxml(tree)
+        else:
+            soup = BeautifulSoup(html_content, 'html.parser')
+            
+            # Сохраним HTML для отладки
+            if self.debug_dump:
+                with open('debug_catalog.html', 'w', encoding='utf-8') as f:
+                    f.write(soup.prettify())
+                print("💾 Каталог HTML сохранен в debug_catalog.html")
+            
+            # Ищем все карточки товаров
+            products = self._extract_products(soup)
         
         result = {
             'products': products,
@@ -39,6 +77,100 @@ class IPhoneCatalogParser:
         print(f"📊 Найдено товаров: {len(products)}")
         return result
     
+    def parse_catalog_stream(self, source, chunk_size=64 * 1024):
+        """Потоковый парсинг каталога: товары отдаются генератором по мере
+        закрытия карточек и сразу идут в iPhoneDatabase.save_catalog.
+        
+        source - путь к файлу или открытый файл (для строки - io.StringIO).
+        """
+        if self.parser != 'lxml':
+            # BeautifulSoup не умеет разбирать по частям
+            with self._open_source(source) as f:
+                return self.parse_catalog_html(f.read())
+        
+        # Та же проверка на пустой HTML, что и в parse_catalog_html: иначе пустой
+        # файл дал бы "успешный" каталог без товаров и снял бы все с продажи
+        chunks = self._iter_chunks(source, chunk_size)
+        head = ''
+        for chunk in chunks:
+            head += chunk
+            if len(head.strip()) >= 100:
+                break
+        if len(head.strip()) < 100:
+            chunks.close()
+            print("❌ HTML слишком короткий или пустой")
+            return {'success': False, 'error': 'Empty HTML'}
+        
+        return {
+            'products': self._iter_products(itertools.chain([head], chunks)),
+            'parsed_at': datetime.now().isoformat(),
+            'streaming': True,
+            'success': True
+        }
+    
+    def iter_catalog_products(self, source, chunk_size=64 * 1024):
+        """Генератор товаров каталога; память ограничена размером одной карточки"""
+        return self._iter_products(self._iter_chunks(source, chunk_size))
+    
+    def _iter_products(self, chunks):
+        """Потоковый разбор частей HTML в товары"""
+        print("🔍 Потоковый разбор каталога HTML...")
+        
+        parser = etree.HTMLPullParser(events=('start', 'end'), tag='div')
+        # Те же классы элементов, что и у lxml.html (нужен text_content)
+        parser.set_element_class_lookup(lxml_html.HtmlElementClassLookup())
+        debug_file = open('debug_catalog.html', 'w', encoding='utf-8') if self.debug_dump else None
+        open_cards = 0
+        found = 0
+        
+        try:
+            for chunk in chunks:
+                if debug_file:
+                    debug_file.write(chunk)
+                parser.feed(chunk)
+                
+                for event, element in parser.read_events():
+                    if 'card' not in (element.get('class') or '').split():
+                        continue
+                    
+                    if event == 'start':
+                        open_cards += 1
+                        continue
+                    
+                    open_cards -= 1
+                    product_data = self._parse_card_lxml(element)
+                    if product_data:
+                        found += 1
+                        yield product_data
+                    
+                    # Карточка разобрана - освобождаем ее и все предыдущие элементы
+                    if open_cards == 0:
+                        element.clear(keep_tail=True)
+                        while element.getprevious() is not None:
+                            del element.getparent()[0]
+            parser.close()
+        finally:
+            if debug_file:
+                debug_file.close()
+                print("💾 Каталог HTML сохранен в debug_catalog.html")
+        
+        print(f"📊 Найдено товаров: {found}")
+    
+    def _open_source(self, source):
+        """Открытие источника HTML: путь - открываем сами, файл - используем как есть"""
+        if isinstance(source, (str, os.PathLike)):
+            return open(source, 'r', encoding='utf-8')
+        return contextlib.nullcontext(source)
+    
+    def _iter_chunks(self, source, chunk_size):
+        """Чтение источника HTML частями"""
+        with self._open_source(source) as f:
+            while True:
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+    
     def _extract_products(self, soup):
         """Извлечение всех товаров из каталога"""
         print("🔍 Ищем карточки товаров...")
@@ -58,12 +190,24 @@ class IPhoneCatalogParser:
         
         return products
     
+    def _extract_products_lxml(self, tree):
+        """Извлечение всех товаров из каталога (lxml, без вывода по каждой карточке)"""
+        card_elements = CARD_XPATH(tree)
+        print(f"🔍 Найдено карточек товаров: {len(card_elements)}")
+        
+        products = []
+        for card in card_elements:
+            product_data = self._parse_card_lxml(card)
+            if product_data:
+                products.append(product_data)
+        
+        return products
+    
     def _parse_single_card(self, card):
         """Парсинг одной карточки товара"""
         try:
             # ID товара
             card_id = card.get('id', '')
-            product_id = card_id.replace('card_c_', '') if 'card_c_' in card_id else 'unknown'
             
             # Название модели
             name_elem = card.find('a', class_='card_name')
@@ -72,14 +216,6 @@ class IPhoneCatalogParser:
             # Цена
             price_elem = card.find('span', class_='card_price')
             price_text = price_elem.get_text().strip() if price_elem else ''
-            numeric_price = 0
-            
-            if price_text:
-                clean_price = price_text.replace(' ', '').replace('руб.', '')
-                try:
-                    numeric_price = int(clean_price)
-                except ValueError:
-                    numeric_price = 0
             
             # Старая цена (если есть)
             old_price_elem = card.find('strike')
@@ -129,108 +265,247 @@ class IPhoneCatalogParser:
             image_url = img_elem.get('src', '') if img_elem else ''
             image_alt = img_elem.get('alt', '') if img_elem else ''
             
-            if image_url and not image_url.startswith('http'):
-                image_url = 'https://edwardpnz.ru' + image_url
-            
             # Ссылка на товар
             link_elem = card.find('a', class_='card_btn')
             product_url = link_elem.get('href', '') if link_elem else ''
-            if product_url and not product_url.startswith('http'):
-                product_url = 'https://edwardpnz.ru' + product_url
             
-            product_data = {
-                'product_id': product_id,
-                'model': model_name,
-                'price': f"{numeric_price:,} руб.".replace(',', ' ') if numeric_price > 0 else 'Не указана',
-                'numeric_price': numeric_price,
-                'old_price': old_price,
-                'current_color': current_color,
-                'available_colors': colors,
-                'current_memory': current_memory,
-                'memory_options': memory_options,
-                'current_sim': current_sim,
-                'sim_options': sim_options,
-                'image_url': image_url,
-                'image_alt': image_alt,
-                'product_url': product_url,
-                'colors_count': len(colors),
-                'memory_count': len(memory_options)
-            }
+            product_data = self._build_product_data(
+                card_id, model_name, price_text, old_price, current_color, colors,
+                memory_options, current_memory, sim_options, current_sim,
+                image_url, image_alt, product_url
+            )
             
-            print(f"✅ Товар {product_id}: {model_name} - {numeric_price} руб.")
+            print(f"✅ Товар {product_data['product_id']}: {model_name} - {product_data['numeric_price']} руб.")
             return product_data
             
         except Exception as e:
             print(f"❌ Ошибка парсинга карточки: {e}")
             return None
+    
+    def _parse_card_lxml(self, card):
+        """Парсинг одной карточки товара (lxml) за один обход ее элементов"""
+        try:
+            card_id = card.get('id', '')
+            name_elem = price_elem = old_price_elem = color_elem = img_elem = link_elem = None
+            colors = []
+            memory_options = []
+            current_memory = 'Не указана'
+            sim_options = []
+            current_sim = 'Не указано'
+            
+            for element in card.iterdescendants():
+                tag = element.tag
+                if not isinstance(tag, str):
+                    # Комментарии и инструкции обработки
+                    continue
+                classes = (element.get('class') or '').split()
+                
+                if tag == 'a':
+                    if name_elem is None and 'card_name' in classes:
+                        name_elem = element
+                    if link_elem is None and 'card_btn' in classes:
+                        link_elem = element
+                elif tag == 'span':
+                    if price_elem is None and 'card_price' in classes:
+                        price_elem = element
+                elif tag == 'strike':
+                    if old_price_elem is None:
+                        old_price_elem = element
+                elif tag == 'small':
+                    if color_elem is None and 'act_color_name' in classes:
+                        color_elem = element
+                elif tag == 'button':
+                    if 'multi_color' in classes:
+                        color_name = element.get('data-name-color') or element.get('title', '')
+                        if color_name and color_name not in colors:
+                            colors.append(color_name)
+                elif tag == 'div':
+                    if 'multi_txt' in classes:
+                        # Память (two_) и SIM (three_) в одном проходе
+                        elem_id = element.get('id', '')
+                        text = element.text_content().strip()
+                        if 'two_' in elem_id and text:
+                            memory_options.append(text)
+                            if 'multi_txt_act' in classes:
+                                current_memory = text
+                        if 'three_' in elem_id and text:
+                            sim_options.append(text)
+                            if 'multi_txt_act' in classes:
+                                current_sim = text
+                elif tag == 'img':
+                    if img_elem is None and 'card_photo_img' in classes:
+                        img_elem = element
+            
+            return self._build_product_data(
+                card_id,
+                name_elem.text_content().strip() if name_elem is not None else 'Неизвестно',
+                price_elem.text_content().strip() if price_elem is not None else '',
+                old_price_elem.text_content().strip() if old_price_elem is not None else '',
+                color_elem.text_content().strip() if color_elem is not None else 'Не указан',
+                colors, memory_options, current_memory, sim_options, current_sim,
+                img_elem.get('src', '') if img_elem is not None else '',
+                img_elem.get('alt', '') if img_elem is not None else '',
+                link_elem.get('href', '') if link_elem is not None else ''
+            )
+            
+        except Exception as e:
+            print(f"❌ Ошибка парсинга карточки: {e}")
+            return None
+    
+    def _build_product_data(self, card_id, model_name, price_text, old_price, current_color, colors,
+                            memory_options, current_memory, sim_options, current_sim,
+                            image_url, image_alt, product_url):
+        """Сборка словаря товара из извлеченных из карточки значений"""
+        product_id = card_id.replace('card_c_', '') if 'card_c_' in card_id else 'unknown'
+        
+        numeric_price = 0
+        if price_text:
+            clean_price = price_text.replace(' ', '').replace('руб.', '')
+            try:
+                numeric_price = int(clean_price)
+            except ValueError:
+                numeric_price = 0
+        
+        if image_url and not image_url.startswith('http'):
+            image_url = 'https://edwardpnz.ru' + image_url
+        
+        if product_url and not product_url.startswith('http'):
+            product_url = 'https://edwardpnz.ru' + product_url
+        
+        product = {
+            'product_id': product_id,
+            'model': model_name,
+            'price': f"{numeric_price:,} руб.".replace(',', ' ') if numeric_price > 0 else 'Не указана',
+            'numeric_price': numeric_price,
+            'old_price': old_price,
+            'current_color': current_color,
+            'available_colors': colors,
+            'current_memory': current_memory,
+            'memory_options': memory_options,
+            'current_sim': current_sim,
+            'sim_options': sim_options,
+            'image_url': image_url,
+            'image_alt': image_alt,
+            'product_url': product_url,
+            'colors_count': len(colors),
+            'memory_count': len(memory_options)
+        }
+        product['content_hash'] = content_hash(product)
+        return product
+
+def content_hash(product):
+    """Хэш содержимого карточки: по нему при сохранении пропускаются неизменившиеся товары"""
+    fields = [product.get(key) for key in (
+        'product_id', 'model', 'numeric_price', 'old_price', 'image_url', 'product_url',
+        'current_color', 'current_memory', 'current_sim',
+    )]
+    # Варианты - в том виде, в каком попадут в базу (без повторов)
+    for _, _, key in CHILD_TABLES:
+        fields.append(list(dict.fromkeys(product.get(key) or [])))
+    return hashlib.sha1(json.dumps(fields, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+def _timestamp(parsed_at):
+    """Время разбора (ISO-строка) в unix-секундах"""
+    try:
+        return int(datetime.fromisoformat(parsed_at).timestamp())
+    except (TypeError, ValueError):
+        return int(datetime.now().timestamp())
+
+def bump_catalog_version(cursor):
+    """Увеличение версии каталога - веб-приложение по ней перезагружает снимок.
+
+    Таблица catalog_meta создается миграцией, база должна быть уже мигрирована.
+    Вместе с версией записывается время изменения (unix-секунды) - из него
+    веб-приложение берет Last-Modified.
+    """
+    cursor.execute('''
+        INSERT INTO catalog_meta (key, value) VALUES ('version', 1)
+        ON CONFLICT(key) DO UPDATE SET value = value + 1
+    ''')
+    cursor.execute('''
+        INSERT INTO catalog_meta (key, value) VALUES ('modified_at', CAST(strftime('%s', 'now') AS INTEGER))
+        ON CONFLICT(key) DO UPDATE SET value = excluded.value
+    ''')
+
+# Дочерние таблицы вариантов товара: (таблица, колонка, ключ в словаре товара)
+CHILD_TABLES = (
+    ('iphone_catalog_colors', 'color_name', 'available_colors'),
+    ('iphone_catalog_memory', 'memory_size', 'memory_options'),
+    ('iphone_catalog_sim', 'sim_type', 'sim_options'),
+)
 
 class iPhoneDatabase:
-    def __init__(self, db_name='iphones_catalog.db'):
+    def __init__(self, db_name='iphones_catalog.db', rules=None):
         self.db_name = db_name
+        # Правила категорий и рекомендуемых товаров для новых и измененных карточек
+        self.rules = rules or RuleEngine()
         self._create_tables()
     
     def _create_tables(self):
         """Создание таблиц базы данных для каталога"""
         conn = sqlite3.connect(self.db_name)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS iphones_catalog (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                product_id TEXT UNIQUE,
-                model TEXT NOT NULL,
-                price INTEGER DEFAULT 0,
-                currency TEXT DEFAULT 'RUB',
-                old_price TEXT,
-                current_color TEXT,
-                current_memory TEXT,
-                current_sim TEXT,
-                image_url TEXT,
-                product_url TEXT,
-                parsed_at DATETIME,
-                created_at DATETIME DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS iphone_catalog_colors (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                product_id TEXT,
-                color_name TEXT,
-                FOREIGN KEY (product_id) REFERENCES iphones_catalog (product_id)
-            )
-        ''')
-        
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS iphone_catalog_memory (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                product_id TEXT,
-                memory_size TEXT,
-                FOREIGN KEY (product_id) REFERENCES iphones_catalog (product_id)
-            )
-        ''')
-        
+        # WAL: веб-приложение продолжает читать каталог во время записи
+        enable_wal(conn)
+        # Схема ведется миграциями (PRAGMA user_version)
+        migrate(conn)
         conn.commit()
         conn.close()
     
-    def save_catalog(self, catalog_data):
-        """Сохранение всего каталога в базу данных"""
+    def save_catalog(self, catalog_data, batch_size=1000, delist_missing=True, force_delist=False):
+        """Сохранение всего каталога в базу данных
+        
+        Товары пачками (executemany) пишутся во временные staging-таблицы, затем
+        одним INSERT ... ON CONFLICT DO UPDATE сливаются в iphones_catalog: id и
+        веб-поля (display_order, is_featured, category) не затираются. Цвета,
+        память и SIM не удаляются целиком, а сверяются с новым набором.
+        
+        Товары с тем же content_hash не перезаписываются (их варианты даже не
+        попадают в staging), а история цен, категории и витрина обновляются
+        только для новых и измененных. Пропавшие из каталога помечаются
+        снятыми с продажи (delist_missing=False - для частичных выгрузок);
+        если товаров пришло меньше MIN_PRODUCTS_RATIO от бывших в продаже,
+        снятие пропускается (force_delist=True - снять все равно, когда
+        поставщик действительно сократил каталог). Версия каталога меняется, только
+        если что-то изменилось.
+        Возвращает счетчики {'added', 'changed', 'removed', 'unchanged'}
+        или False при ошибке.
+        """
         if not catalog_data.get('success', False):
             return False
             
         conn = sqlite3.connect(self.db_name)
+        conn.execute('PRAGMA synchronous = NORMAL')
+        # Staging-таблицы держим в памяти
+        conn.execute('PRAGMA temp_store = MEMORY')
+        # Кэш страниц побольше: индексы каталога при первичной загрузке не вытесняются на диск
+        conn.execute('PRAGMA cache_size = -65536')
         cursor = conn.cursor()
         
         saved_count = 0
         try:
+            self._create_staging_tables(cursor)
+            
+            parsed_at = catalog_data.get('parsed_at')
+            # Хэши товаров в продаже: варианты неизменившихся карточек в staging не пишем
+            known = dict(cursor.execute(
+                'SELECT product_id, content_hash FROM iphones_catalog WHERE NOT is_delisted'
+            ))
+            seen = set()
+            products_batch = []
+            children_batch = {table: [] for table, _, _ in CHILD_TABLES}
+            
             for product in catalog_data.get('products', []):
-                cursor.execute('''
-                    INSERT OR REPLACE INTO iphones_catalog 
-                    (product_id, model, price, currency, old_price, current_color, 
-                     current_memory, current_sim, image_url, product_url, parsed_at)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                ''', (
-                    product.get('product_id'),
+                product_id = product.get('product_id')
+                if product_id in seen:
+                    # Повтор карточки: как и раньше, побеждает последняя
+                    self._flush_staging(cursor, products_batch, children_batch)
+                    for table, _, _ in CHILD_TABLES:
+                        cursor.execute(f'DELETE FROM staging_{table} WHERE product_id = ?', (product_id,))
+                seen.add(product_id)
+                
+                product_hash = product.get('content_hash') or content_hash(product)
+                products_batch.append((
+                    product_id,
                     product.get('model'),
                     product.get('numeric_price'),
                     'RUB',
@@ -240,49 +515,240 @@ class iPhoneDatabase:
                     product.get('current_sim'),
                     product.get('image_url'),
                     product.get('product_url'),
-                    catalog_data.get('parsed_at')
+                    parsed_at,
+                    product_hash
                 ))
-                
-                product_id = product.get('product_id')
-                
-                # Сохраняем цвета
-                cursor.execute('DELETE FROM iphone_catalog_colors WHERE product_id = ?', (product_id,))
-                for color in product.get('available_colors', []):
-                    cursor.execute('INSERT INTO iphone_catalog_colors (product_id, color_name) VALUES (?, ?)', (product_id, color))
-                
-                # Сохраняем память
-                cursor.execute('DELETE FROM iphone_catalog_memory WHERE product_id = ?', (product_id,))
-                for memory in product.get('memory_options', []):
-                    cursor.execute('INSERT INTO iphone_catalog_memory (product_id, memory_size) VALUES (?, ?)', (product_id, memory))
+                if known.get(product_id) != product_hash:
+                    for table, _, key in CHILD_TABLES:
+                        children_batch[table].extend((product_id, value) for value in dict.fromkeys(product.get(key, [])))
                 
                 saved_count += 1
+                if len(products_batch) >= batch_size:
+                    self._flush_staging(cursor, products_batch, children_batch)
             
+            self._flush_staging(cursor, products_batch, children_batch)
+            changes = self._merge_staging(cursor, parsed_at, delist_missing, force_delist)
+            
+            if changes['added'] or changes['changed'] or changes['removed']:
+                bump_catalog_version(cursor)
             conn.commit()
-            print(f"💾 Сохранено товаров: {saved_count}")
-            return True
+            # Обновление статистики планировщика, если данные заметно изменились
+            conn.execute('PRAGMA optimize')
+            print(f"💾 Сохранено товаров: {saved_count} (новых: {changes['added']}, "
+                  f"изменено: {changes['changed']}, снято: {changes['removed']}, "
+                  f"без изменений: {changes['unchanged']})")
+            return changes
             
         except Exception as e:
             print(f"❌ Ошибка сохранения каталога: {e}")
             return False
         finally:
             conn.close()
+    
+    def _create_staging_tables(self, cursor):
+        """Временные таблицы для пакетной загрузки (живут до закрытия соединения)"""
+        cursor.execute('''
+            CREATE TEMP TABLE staging_products (
+                product_id TEXT PRIMARY KEY,
+                model TEXT,
+                price INTEGER,
+                currency TEXT,
+                old_price TEXT,
+                current_color TEXT,
+                current_memory TEXT,
+                current_sim TEXT,
+                image_url TEXT,
+                product_url TEXT,
+                parsed_at DATETIME,
+                content_hash TEXT
+            )
+        ''')
+        for table, column, _ in CHILD_TABLES:
+            cursor.execute(f'''
+                CREATE TEMP TABLE staging_{table} (
+                    product_id TEXT,
+                    {column} TEXT
+                )
+            ''')
+    
+    def _flush_staging(self, cursor, products_batch, children_batch):
+        """Запись накопленной пачки в staging-таблицы"""
+        if products_batch:
+            cursor.executemany(
+                'INSERT OR REPLACE INTO staging_products VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                products_batch
+            )
+            products_batch.clear()
+        for table, column, _ in CHILD_TABLES:
+            rows = children_batch[table]
+            if rows:
+                cursor.executemany(f'INSERT INTO staging_{table} (product_id, {column}) VALUES (?, ?)', rows)
+                rows.clear()
+    
+    def _merge_staging(self, cursor, parsed_at, delist_missing=True, force_delist=False):
+        """Слияние staging-таблиц с основными (только новые и изменившиеся товары)"""
+        # Новые, изменившиеся и вернувшиеся в продажу товары
+        cursor.execute('CREATE TEMP TABLE staging_changed (product_id TEXT PRIMARY KEY, is_new INTEGER)')
+        cursor.execute('''
+            INSERT INTO staging_changed (product_id, is_new)
+            SELECT s.product_id, c.product_id IS NULL
+            FROM staging_products s
+            LEFT JOIN iphones_catalog c ON c.product_id = s.product_id
+            WHERE c.product_id IS NULL
+               OR c.content_hash IS NOT s.content_hash
+               OR c.is_delisted
+        ''')
+        added, changed = cursor.execute(
+            'SELECT COALESCE(SUM(is_new), 0), COALESCE(SUM(NOT is_new), 0) FROM staging_changed'
+        ).fetchone()
+        total = cursor.execute('SELECT COUNT(*) FROM staging_products').fetchone()[0]
+        active = cursor.execute('SELECT COUNT(*) FROM iphones_catalog WHERE NOT is_delisted').fetchone()[0]
+        
+        # WHERE обязателен для upsert из SELECT (иначе ON неоднозначен).
+        # ORDER BY rowid - новые товары получают id (display_order) в порядке
+        # страницы, а не в порядке первичного ключа staging (повтор карточки
+        # через INSERT OR REPLACE уже переехал в конец)
+        cursor.execute('''
+            INSERT INTO iphones_catalog
+            (product_id, model, price, currency, old_price, current_color,
+             current_memory, current_sim, image_url, product_url, parsed_at,
+             content_hash, is_delisted, delisted_at)
+            SELECT product_id, model, price, currency, old_price, current_color,
+                   current_memory, current_sim, image_url, product_url, parsed_at,
+                   content_hash, 0, NULL
+            FROM staging_products
+            WHERE product_id IN (SELECT product_id FROM staging_changed)
+            ORDER BY rowid
+            ON CONFLICT(product_id) DO UPDATE SET
+                model = excluded.model,
+                price = excluded.price,
+                currency = excluded.currency,
+                old_price = excluded.old_price,
+                current_color = excluded.current_color,
+                current_memory = excluded.current_memory,
+                current_sim = excluded.current_sim,
+                image_url = excluded.image_url,
+                product_url = excluded.product_url,
+                parsed_at = excluded.parsed_at,
+                content_hash = excluded.content_hash,
+                is_delisted = 0,
+                delisted_at = NULL
+        ''')
+        
+        for table, column, _ in CHILD_TABLES:
+            # Индекс строим один раз после загрузки - быстрее, чем поддерживать его при вставке
+            cursor.execute(f'CREATE INDEX temp.idx_staging_{table} ON staging_{table} (product_id, {column})')
+            
+            # Удаляем варианты, которых больше нет у обновленных товаров
+            cursor.execute(f'''
+                DELETE FROM {table}
+                WHERE product_id IN (SELECT product_id FROM staging_changed)
+                  AND NOT EXISTS (
+                      SELECT 1 FROM staging_{table} s
+                      WHERE s.product_id = {table}.product_id AND s.{column} = {table}.{column}
+                  )
+            ''')
+            # Добавляем новые варианты
+            cursor.execute(f'''
+                INSERT INTO {table} (product_id, {column})
+                SELECT s.product_id, s.{column} FROM staging_{table} s
+                WHERE s.product_id IN (SELECT product_id FROM staging_changed)
+                  AND NOT EXISTS (
+                    SELECT 1 FROM {table} t
+                    WHERE t.product_id = s.product_id AND t.{column} = s.{column}
+                )
+                ORDER BY s.rowid
+            ''')
+        
+        # История цен: новая точка, только если цена отличается от последней
+        # записанной (товары без истории получают первую точку). Цена входит
+        # в content_hash, поэтому проверяются только измененные товары
+        cursor.execute('''
+            INSERT OR REPLACE INTO iphone_price_history (product_id, ts, price)
+            SELECT s.product_id, ?, s.price FROM staging_products s
+            WHERE s.product_id IN (SELECT product_id FROM staging_changed)
+              AND s.price > 0
+              AND s.price IS NOT (
+                  SELECT h.price FROM iphone_price_history h
+                  WHERE h.product_id = s.product_id
+                  ORDER BY h.ts DESC LIMIT 1
+              )
+        ''', (_timestamp(parsed_at),))
+        
+        removed = 0
+        if delist_missing and (total == 0 or (total < active * MIN_PRODUCTS_RATIO and not force_delist)):
+            # Пустая или обрезанная выгрузка (сбой разбора, пустая страница) -
+            # не повод снимать с продажи весь каталог
+            print(f"⚠️ Получено товаров: {total} из {active} в продаже - снятие с продажи пропущено "
+                  f"(--force-delist - снять все равно)")
+        elif delist_missing:
+            # Товары, пропавшие из каталога, не удаляем, а снимаем с продажи
+            cursor.execute('''
+                UPDATE iphones_catalog SET is_delisted = 1, delisted_at = ?
+                WHERE NOT is_delisted
+                  AND product_id NOT IN (SELECT product_id FROM staging_products)
+            ''', (parsed_at or datetime.now().isoformat(),))
+            removed = cursor.rowcount
+        
+        # Категории и витрина для веба: только измененные товары, снятые убираем
+        changed_ids = [row[0] for row in cursor.execute('SELECT product_id FROM staging_changed')]
+        apply_rules(cursor, self.rules, changed_ids)
+        refresh_read_model(cursor, changed_ids)
+        if removed:
+            cursor.execute('''
+                DELETE FROM catalog_read_model
+                WHERE product_id IN (SELECT product_id FROM iphones_catalog WHERE is_delisted)
+            ''')
+        
+        return {'added': added, 'changed': changed, 'removed': removed, 'unchanged': total - added - changed}
 
-def main_catalog():
-    """Основная функция для парсинга каталога"""
-    parser = IPhoneCatalogParser()
-    db = iPhoneDatabase()
+def main_catalog(stream=True, debug_dump=False, images=False, publish=False, force_delist=False):
+    """Основная функция для парсинга каталога
     
-    # Читаем HTML из файла
-    try:
-        with open('site-html.txt', 'r', encoding='utf-8') as f:
-            catalog_html = f.read()
-        print(f"📁 HTML загружен из файла, размер: {len(catalog_html)} символов")
-    except FileNotFoundError:
+    stream=True - потоковый режим: товары пишутся в базу по мере разбора,
+    не дожидаясь чтения всей страницы.
+    images=True - после сохранения скачать новые изображения и сделать копии.
+    publish=True - запись в новую копию базы с проверкой и атомарной заменой
+    (publish.py): веб-приложение не видит частично сохраненный каталог.
+    force_delist=True - снять с продажи пропавшие товары, даже если их
+    больше половины каталога (поставщик действительно сократил ассортимент).
+    """
+    parser = IPhoneCatalogParser(debug_dump=debug_dump)
+    
+    if not os.path.exists('site-html.txt'):
         print("❌ Файл site-html.txt не найден")
         return
     
+    def save(result, db_name='iphones_catalog.db'):
+        """Сохранение каталога (и изображений) в базу db_name"""
+        db = iPhoneDatabase(db_name)
+        if not db.save_catalog(result, force_delist=force_delist):
+            print("❌ Ошибка сохранения каталога в базу")
+            return False
+        print(f"\n💾 Весь каталог сохранен в базу данных")
+        if images:
+            ImagePipeline(db_name).run()
+        return True
+    
+    def store(result):
+        if publish:
+            # С force_delist сокращение каталога ожидаемо - проверку доли товаров не делаем
+            return publish_database(lambda db_name: save(result, db_name),
+                                    min_ratio=0 if force_delist else MIN_PRODUCTS_RATIO)
+        return save(result)
+    
     print("=== ПАРСИНГ КАТАЛОГА IPHONE ===")
     
+    if stream:
+        print(f"📁 Потоковое чтение site-html.txt, размер: {os.path.getsize('site-html.txt')} байт")
+        store(parser.parse_catalog_stream('site-html.txt'))
+        return
+    
+    # Читаем HTML из файла
+    with open('site-html.txt', 'r', encoding='utf-8') as f:
+        catalog_html = f.read()
+    print(f"📁 HTML загружен из файла, размер: {len(catalog_html)} символов")
+    
     result = parser.parse_catalog_html(catalog_html)
     
     if result.get('success'):
@@ -299,10 +765,7 @@ def main_catalog():
             print(f"🆔 ID: {product['product_id']}")
         
         # Сохраняем в базу
-        if db.save_catalog(result):
-            print(f"\n💾 Весь каталог сохранен в базу данных")
-        else:
-            print("❌ Ошибка сохранения каталога в базу")
+        store(result)
     else:
         print("❌ Ошибка парсинга каталога")
 
@@ -331,8 +794,13 @@ def main_single():
         print("❌ Ошибка парсинга одного товара")
 
 if __name__ == "__main__":
-    # Запускаем парсинг каталога
-    main_catalog()
+    # Запускаем парсинг каталога (--no-stream - разбор целиком, --debug - сохранить debug_catalog.html,
+    # --images - скачать изображения товаров и сделать уменьшенные копии,
+    # --publish - собрать новую базу отдельно и атомарно заменить ею текущую,
+    # --force-delist - снять пропавшие товары, даже если пропало больше половины каталога)
+    main_catalog(stream='--no-stream' not in sys.argv, debug_dump='--debug' in sys.argv,
+                 images='--images' in sys.argv, publish='--publish' in sys.argv,
+                 force_delist='--force-delist' in sys.argv)
     
     print("\n" + "="*50)
     
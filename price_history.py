@@ -0,0 +1,72 @@
+# price_history.py
+import sqlite3
+
+# Сколько точек отдавать по умолчанию и максимум за один запрос
+DEFAULT_POINTS = 200
+MAX_POINTS = 1000
+
+
+def load_price_history(conn, product_id, start=None, end=None):
+    """Изменения цены товара за период: список (ts, price) по возрастанию времени.
+
+    Первой идет последняя цена до начала периода - она действовала на его
+    начало (история хранит только изменения).
+    """
+    conditions = ['product_id = ?']
+    params = [product_id]
+    if start is not None:
+        conditions.append('ts >= ?')
+        params.append(start)
+    if end is not None:
+        conditions.append('ts <= ?')
+        params.append(end)
+
+    try:
+        rows = conn.execute(f'''
+            SELECT ts, price FROM iphone_price_history
+            WHERE {' AND '.join(conditions)}
+            ORDER BY ts
+        ''', params).fetchall()
+
+        if start is not None:
+            before = conn.execute('''
+                SELECT ts, price FROM iphone_price_history
+                WHERE product_id = ? AND ts < ?
+                ORDER BY ts DESC LIMIT 1
+            ''', (product_id, start)).fetchone()
+            if before is not None:
+                rows.insert(0, (start, before[1]))
+    except sqlite3.OperationalError:
+        # База создана до появления истории цен
+        return []
+
+    return [(ts, price) for ts, price in rows]
+
+
+def downsample(points, max_points=DEFAULT_POINTS):
+    """Прореживание ряда до max_points интервалов одинаковой длины.
+
+    Для каждого интервала: время первой точки, последняя цена (как на
+    ступенчатом графике), минимум и максимум - скачки цены не теряются.
+    Возвращает (точки, длина интервала в секундах; 0 - без прореживания).
+    """
+    if len(points) <= max_points:
+        return [{'t': ts, 'price': price, 'min': price, 'max': price} for ts, price in points], 0
+
+    first, last = points[0][0], points[-1][0]
+    # Округление вверх, чтобы интервалов было не больше max_points
+    resolution = max(1, -(-(last - first + 1) // max_points))
+
+    buckets = []
+    current = None
+    for ts, price in points:
+        bucket = (ts - first) // resolution
+        if current is None or current[0] != bucket:
+            current = [bucket, {'t': ts, 'price': price, 'min': price, 'max': price}]
+            buckets.append(current[1])
+        else:
+            point = current[1]
+            point['price'] = price
+            point['min'] = min(point['min'], price)
+            point['max'] = max(point['max'], price)
+    return buckets, resolution
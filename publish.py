@@ -0,0 +1,235 @@
+# publish.py
+import os
+import re
+import sqlite3
+import tempfile
+from datetime import datetime
+from urllib.request import pathname2url
+
+from migrations import MIGRATIONS, check_query_plans, migrate, schema_version
+
+# Новый каталог не публикуется, если в нем меньше этой доли товаров текущего
+# (например, парсер получил пустую или обрезанную страницу)
+MIN_PRODUCTS_RATIO = 0.5
+# Сколько последних поколений хранить (предыдущее еще могут читать старые соединения)
+KEEP_GENERATIONS = 2
+
+
+def _active_products(conn):
+    """Число товаров в продаже"""
+    return conn.execute('SELECT COUNT(*) FROM iphones_catalog WHERE NOT is_delisted').fetchone()[0]
+
+
+def _remove(path):
+    """Удаление файла базы вместе с ее журналами"""
+    for suffix in ('', '-journal', '-wal', '-shm'):
+        try:
+            os.remove(path + suffix)
+        except OSError:
+            pass
+
+
+def _fsync(path):
+    """Сброс файла на диск перед переименованием"""
+    with open(path, 'rb+') as f:
+        os.fsync(f.fileno())
+
+
+def _fsync_directory(path):
+    """Сброс каталога с файлом на диск (на POSIX - чтобы переименование пережило сбой)"""
+    if hasattr(os, 'O_DIRECTORY'):
+        fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+
+def generation_path(db_path, generation):
+    """Файл поколения базы: iphones_catalog.db -> iphones_catalog.<поколение>.db"""
+    root, ext = os.path.splitext(db_path)
+    return f'{root}.{generation}{ext}'
+
+
+def generations(db_path):
+    """Файлы поколений базы от старых к новым"""
+    root, ext = os.path.splitext(os.path.abspath(db_path))
+    directory, prefix = os.path.split(root)
+    pattern = re.compile(re.escape(prefix) + r'\.\d{20}' + re.escape(ext) + '$')
+    return sorted(os.path.join(directory, name) for name in os.listdir(directory) if pattern.match(name))
+
+
+def _point_to(db_path, target):
+    """Атомарное переключение db_path (символической ссылки) на файл поколения.
+
+    SQLite разрешает ссылку и ведет журналы по имени настоящего файла,
+    поэтому новое поколение никогда не встретит -wal прежнего.
+    """
+    link = db_path + '.link'
+    if os.path.lexists(link):
+        os.remove(link)
+    os.symlink(os.path.basename(target), link)
+    os.replace(link, db_path)
+
+
+def _checkout_wal(db_path):
+    """Перевод текущей базы из WAL в режим DELETE (журнал сливается в файл и удаляется).
+
+    Возвращает False, если -wal остался - его держат открытые соединения.
+    """
+    if os.path.exists(db_path):
+        conn = sqlite3.connect(db_path, timeout=0)
+        try:
+            conn.execute('PRAGMA journal_mode = DELETE')
+        except sqlite3.OperationalError:
+            pass
+        finally:
+            conn.close()
+    return not os.path.exists(db_path + '-wal')
+
+
+def copy_database(source, target):
+    """Копия опубликованной базы - основа следующего поколения.
+
+    Источник открывается только на чтение (backup API), поэтому читатели
+    не блокируются. В копии сохраняются история цен, снятые с продажи
+    товары, кэш обхода и обработанные изображения.
+    """
+    if not os.path.exists(source):
+        return
+    uri = 'file:' + pathname2url(os.path.abspath(source)) + '?mode=ro'
+    src = sqlite3.connect(uri, uri=True)
+    dst = sqlite3.connect(target)
+    try:
+        src.backup(dst)
+    finally:
+        dst.close()
+        src.close()
+
+
+def finalize_database(path):
+    """Индексы, статистика планировщика и VACUUM перед публикацией.
+
+    Опубликованная база - в режиме журнала DELETE: файл самодостаточен
+    (нет -wal, который не переедет вместе с rename) и больше не меняется,
+    а на read-only файловой системе открывается без -shm (см. ConnectionPool).
+    """
+    conn = sqlite3.connect(path)
+    try:
+        migrate(conn)
+        conn.execute('PRAGMA journal_mode = DELETE')
+        conn.execute('ANALYZE')
+        conn.commit()
+        conn.execute('VACUUM')
+    finally:
+        conn.close()
+
+
+def validate_database(path, min_products=1):
+    """Проверка базы перед публикацией; возвращает список проблем (пустой - все в порядке)"""
+    conn = sqlite3.connect(path)
+    try:
+        problems = []
+        integrity = conn.execute('PRAGMA quick_check').fetchone()[0]
+        if integrity != 'ok':
+            problems.append(f'quick_check: {integrity}')
+            return problems
+
+        # В режиме WAL база на read-only диске не откроется (нужен -shm)
+        journal_mode = conn.execute('PRAGMA journal_mode').fetchone()[0]
+        if journal_mode != 'delete':
+            problems.append(f'режим журнала {journal_mode}, ожидается delete')
+
+        version = schema_version(conn)
+        if version != len(MIGRATIONS):
+            problems.append(f'версия схемы {version}, ожидается {len(MIGRATIONS)}')
+            return problems
+
+        for name, details in check_query_plans(conn).items():
+            problems.append(f'запрос {name} без индекса: {"; ".join(details)}')
+
+        products = _active_products(conn)
+        if products < min_products:
+            problems.append(f'товаров в продаже {products}, нужно не меньше {min_products}')
+
+        # Веб-приложение читает только витрину - она должна совпадать с каталогом
+        read_model = conn.execute('SELECT COUNT(*) FROM catalog_read_model').fetchone()[0]
+        if read_model != products:
+            problems.append(f'в витрине {read_model} товаров, в каталоге {products}')
+        return problems
+    finally:
+        conn.close()
+
+
+def publish_database(build, db_path='iphones_catalog.db', min_ratio=MIN_PRODUCTS_RATIO):
+    """Сборка нового поколения базы в отдельном файле и атомарная замена.
+
+    copy -> build(path) -> индексы -> VACUUM -> проверка -> переключение.
+    build получает путь к копии текущей базы и делает в ней всю запись
+    (сохранение, категоризация, изображения); False - отказ от публикации.
+
+    Готовая база переименовывается в файл поколения (iphones_catalog.<N>.db),
+    а db_path становится символической ссылкой на него и переключается
+    атомарно. У каждого поколения свои журналы, так что новый файл не
+    подхватит -wal прежнего. Веб-процесс все это время читает старый файл
+    без блокировок и видит либо старый каталог целиком, либо новый:
+    ConnectionPool замечает замену файла и переоткрывает соединения.
+
+    Без символических ссылок (Windows без прав) текущая база сначала
+    переводится из WAL в DELETE; если журнал держат открытые соединения,
+    публикация отменяется. Публикации не должны идти параллельно - при
+    гонке остается последняя. Возвращает True, если поколение опубликовано.
+    """
+    directory = os.path.dirname(os.path.abspath(db_path))
+    fd, new_path = tempfile.mkstemp(dir=directory, prefix=os.path.basename(db_path) + '.', suffix='.new')
+    os.close(fd)
+
+    try:
+        copy_database(db_path, new_path)
+        conn = sqlite3.connect(new_path)
+        try:
+            migrate(conn)
+            previous = _active_products(conn)
+        finally:
+            conn.close()
+
+        print(f"📦 Сборка нового поколения базы: {new_path}")
+        if build(new_path) is False:
+            print("❌ Сборка базы не удалась - публикация отменена")
+            _remove(new_path)
+            return False
+
+        finalize_database(new_path)
+        problems = validate_database(new_path, max(1, int(previous * min_ratio)))
+        if problems:
+            for problem in problems:
+                print(f"❌ {problem}")
+            print("❌ Проверка базы не пройдена - публикация отменена")
+            _remove(new_path)
+            return False
+
+        _fsync(new_path)
+        target = generation_path(db_path, datetime.now().strftime('%Y%m%d%H%M%S%f'))
+        os.replace(new_path, target)
+    except Exception:
+        _remove(new_path)
+        raise
+
+    try:
+        _point_to(db_path, target)
+    except OSError:
+        # Символические ссылки недоступны - заменяем сам файл, но только без чужого -wal рядом
+        if not _checkout_wal(db_path):
+            print(f"❌ {db_path} открыта в режиме WAL другими процессами - публикация отменена")
+            _remove(target)
+            return False
+        os.replace(target, db_path)
+        target = db_path
+    _fsync_directory(db_path)
+
+    # Старые поколения больше не нужны: новые соединения открывают текущее
+    for path in generations(db_path)[:-KEEP_GENERATIONS]:
+        _remove(path)
+
+    print(f"✅ Опубликовано новое поколение базы {os.path.basename(target)}")
+    return True
@@ -0,0 +1,157 @@
+# read_model.py
+import json
+import sqlite3
+
+# Служебные колонки парсера - в товары витрины (и ответы API) не попадают
+INGEST_COLUMNS = ('content_hash', 'is_delisted', 'delisted_at')
+
+# Поля-списки: в JSON хранятся массивами, в снимке - кортежами
+LIST_FIELDS = ('colors_list', 'memory_list', 'sim_list')
+
+# Один кодировщик на все строки витрины (товары - плоские словари без циклов)
+_encoder = json.JSONEncoder(ensure_ascii=False, check_circular=False, separators=(',', ':'))
+
+
+def format_price(price):
+    """Форматирование цены для отображения"""
+    return f"{price:,} руб.".replace(',', ' ')
+
+
+def _distinct(values):
+    """Уникальные значения в порядке сортировки (как GROUP_CONCAT(DISTINCT ...))"""
+    return sorted(set(value for value in values if value is not None))
+
+
+def _variants(conn, table, column, where, ordered=True):
+    """Варианты товаров из дочерней таблицы: product_id -> список значений.
+
+    ordered=False - порядок добавления не важен (значения потом сортируются):
+    выборка по where идет по индексу без сортировки всей таблицы по id.
+    """
+    order = 'ORDER BY id' if ordered else ''
+    variants = {}
+    try:
+        for product_id, value in conn.execute(f'SELECT product_id, {column} FROM {table} {where} {order}'):
+            variants.setdefault(product_id, []).append(value)
+    except sqlite3.OperationalError:
+        # База создана до появления таблицы (например, вариантов SIM)
+        pass
+    return variants
+
+
+def product_view(product, colors, memory, sims):
+    """Готовый к отображению товар: строка iphones_catalog + списки вариантов"""
+    for column in INGEST_COLUMNS:
+        product.pop(column, None)
+    product_colors = _distinct(colors)
+    product_memory = _distinct(memory)
+
+    product['all_colors'] = ','.join(product_colors) if product_colors else None
+    product['all_memory'] = ','.join(product_memory) if product_memory else None
+    product['formatted_price'] = format_price(product['price'])
+    product['short_model'] = product['model'][:30] + '...' if len(product['model']) > 30 else product['model']
+
+    if product_colors:
+        product['colors_list'] = tuple(product_colors)
+    else:
+        product['colors_list'] = (product['current_color'],) if product['current_color'] else ()
+
+    if product_memory:
+        product['memory_list'] = tuple(product_memory)
+    else:
+        product['memory_list'] = (product['current_memory'],) if product['current_memory'] else ()
+
+    product_sims = list(dict.fromkeys(sims))
+    if product_sims:
+        product['sim_list'] = tuple(product_sims)
+    else:
+        product['sim_list'] = (product['current_sim'],) if product['current_sim'] else ()
+
+    return product
+
+
+def build_products(conn, where=''):
+    """Товары в продаже из исходных таблиц (четыре плоских запроса без JOIN).
+
+    where - условие на product_id, общее для всех таблиц (пусто - весь каталог).
+    """
+    query = conn.execute(f'SELECT * FROM iphones_catalog {where}')
+    names = [description[0] for description in query.description]
+    rows = query.fetchall()
+
+    # Цвета и память product_view сортирует сам, SIM - в порядке добавления
+    colors = _variants(conn, 'iphone_catalog_colors', 'color_name', where, ordered=False)
+    memory = _variants(conn, 'iphone_catalog_memory', 'memory_size', where, ordered=False)
+    sims = _variants(conn, 'iphone_catalog_sim', 'sim_type', where)
+
+    products = []
+    for row in rows:
+        product = dict(zip(names, row))
+        if product.get('is_delisted'):
+            # Снятые с продажи товары остаются в базе, но не в каталоге
+            continue
+        product_id = product['product_id']
+        products.append(product_view(
+            product, colors.get(product_id, ()), memory.get(product_id, ()), sims.get(product_id, ())
+        ))
+    return products
+
+
+def create_read_model(cursor):
+    """Таблица-витрина: одна строка на товар с готовыми для веба полями"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS catalog_read_model (
+            product_id TEXT PRIMARY KEY,
+            category TEXT,
+            is_featured INTEGER,
+            price INTEGER,
+            display_order INTEGER,
+            data TEXT NOT NULL
+        )
+    ''')
+
+
+def refresh_read_model(cursor, product_ids=None):
+    """Пересборка витрины catalog_read_model.
+
+    product_ids=None - весь каталог (после категоризации), иначе только
+    указанные товары (после инкрементального сохранения). Снятые с продажи
+    товары из витрины удаляются.
+    """
+    if product_ids is None:
+        cursor.execute('DELETE FROM catalog_read_model')
+        where = ''
+    else:
+        cursor.execute('CREATE TEMP TABLE IF NOT EXISTS read_model_ids (product_id TEXT PRIMARY KEY)')
+        cursor.execute('DELETE FROM read_model_ids')
+        cursor.executemany('INSERT OR IGNORE INTO read_model_ids VALUES (?)', ((pid,) for pid in product_ids))
+        where = 'WHERE product_id IN (SELECT product_id FROM read_model_ids)'
+        cursor.execute(f'DELETE FROM catalog_read_model {where}')
+
+    cursor.executemany('''
+        INSERT INTO catalog_read_model (product_id, category, is_featured, price, display_order, data)
+        VALUES (?, ?, ?, ?, ?, ?)
+    ''', [(
+        product['product_id'],
+        product.get('category'),
+        product.get('is_featured'),
+        product['price'],
+        product.get('display_order'),
+        _encoder.encode(product),
+    ) for product in build_products(cursor, where)])
+
+
+def load_read_model(conn):
+    """Товары из витрины одним запросом или None, если витрины в базе нет"""
+    try:
+        rows = conn.execute('SELECT data FROM catalog_read_model').fetchall()
+    except sqlite3.OperationalError:
+        return None
+
+    products = []
+    for (data,) in rows:
+        product = json.loads(data)
+        for field in LIST_FIELDS:
+            product[field] = tuple(product[field])
+        products.append(product)
+    return products
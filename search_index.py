@@ -0,0 +1,107 @@
+# search_index.py
+import re
+from bisect import bisect_left
+
+# Слова в тексте и запросе (латиница, кириллица, цифры)
+WORD_RE = re.compile(r'\w+')
+# Разбиение слова на числовые и буквенные части: 256Gb -> 256, gb
+PART_RE = re.compile(r'\d+|[^\W\d_]+')
+
+# Русские написания, по которым тоже должен находиться товар
+ALIASES = {
+    'iphone': ('айфон',),
+    'pro': ('про',),
+    'max': ('макс',),
+    'plus': ('плюс',),
+    'mini': ('мини',),
+    'air': ('эйр',),
+    'esim': ('есим',),
+    'sim': ('сим',),
+    'gb': ('гб',),
+    'tb': ('тб',),
+    'black': ('черный',),
+    'white': ('белый',),
+    'blue': ('синий', 'голубой'),
+    'green': ('зеленый',),
+    'pink': ('розовый',),
+    'red': ('красный',),
+    'yellow': ('желтый',),
+    'purple': ('фиолетовый',),
+    'gold': ('золотой',),
+    'silver': ('серебристый',),
+    'orange': ('оранжевый',),
+}
+
+
+def normalize(text):
+    """Приведение текста к виду для поиска: регистр, ё, Б/У"""
+    return text.casefold().replace('ё', 'е').replace('б/у', 'бу')
+
+
+def tokenize_query(text):
+    """Токены поискового запроса"""
+    return WORD_RE.findall(normalize(text))
+
+
+def tokenize_document(*values):
+    """Токены товара: слова, их числовые/буквенные части и русские синонимы"""
+    tokens = set()
+    for value in values:
+        if not value:
+            continue
+        for word in WORD_RE.findall(normalize(value)):
+            tokens.add(word)
+            tokens.update(PART_RE.findall(word))
+    for token in list(tokens):
+        tokens.update(ALIASES.get(token, ()))
+    return tokens
+
+
+class SearchIndex:
+    """Инвертированный индекс по товарам каталога с префиксным поиском.
+
+    Все токены хранятся в отсортированном списке, поэтому товары по префиксу
+    находятся бинарным поиском, а не перебором каталога.
+    """
+
+    def __init__(self, products):
+        postings = {}
+        for product in products:
+            tokens = tokenize_document(
+                product['model'],
+                product['current_color'],
+                product['current_memory'],
+                product['current_sim'],
+                *product['colors_list'],
+                *product['memory_list'],
+                *product['sim_list'],
+            )
+            for token in tokens:
+                postings.setdefault(token, set()).add(product['product_id'])
+
+        self.tokens = sorted(postings)
+        self.postings = {token: frozenset(ids) for token, ids in postings.items()}
+
+    def _prefix_matches(self, prefix):
+        """ID товаров, у которых есть токен с данным префиксом"""
+        matched = set()
+        position = bisect_left(self.tokens, prefix)
+        while position < len(self.tokens) and self.tokens[position].startswith(prefix):
+            matched |= self.postings[self.tokens[position]]
+            position += 1
+        return matched
+
+    def search(self, query):
+        """ID товаров, подходящих под все слова запроса (None - пустой запрос)"""
+        tokens = tokenize_query(query)
+        if not tokens:
+            return None
+
+        result = None
+        # Сначала самые длинные (обычно самые избирательные) токены
+        for token in sorted(set(tokens), key=len, reverse=True):
+            matched = self._prefix_matches(token)
+            result = matched if result is None else result & matched
+            if not result:
+                return set()
+        return result
@@ -0,0 +1,101 @@
+# similar_index.py
+import re
+from bisect import bisect_left
+
+# Номер поколения в названии модели: "iPhone 16 Pro" -> 16
+GENERATION_RE = re.compile(r'iphone\s+(\d+)', re.IGNORECASE)
+
+# Сколько соседей по цене рассматривать с каждой стороны
+PRICE_WINDOW = 10
+# Сколько похожих товаров хранить на товар
+MAX_SIMILAR = 12
+
+
+def model_generation(model):
+    """Поколение модели или None (например, для iPhone Air)"""
+    match = GENERATION_RE.search(model or '')
+    return int(match.group(1)) if match else None
+
+
+def _jaccard(a, b):
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+def _price_key(feature):
+    return (feature['price'] or 0, feature['product_id'])
+
+
+def similarity_score(product, other):
+    """Оценка похожести двух товаров (чем больше, тем ближе)"""
+    score = 0.0
+
+    if product['category'] == other['category']:
+        score += 3.0
+
+    # Близость цены: 2 балла за одинаковую цену, 0 при разнице в 100% и больше
+    price, other_price = product['price'] or 0, other['price'] or 0
+    top = max(price, other_price)
+    if top:
+        score += 2.0 * (1.0 - min(abs(price - other_price) / top, 1.0))
+
+    generation, other_generation = product['generation'], other['generation']
+    if generation is not None and other_generation is not None:
+        if generation == other_generation:
+            score += 2.0
+        elif abs(generation - other_generation) == 1:
+            score += 1.0
+
+    score += _jaccard(product['memory_set'], other['memory_set'])
+    score += 0.5 * _jaccard(product['colors_set'], other['colors_set'])
+    return score
+
+
+class SimilarIndex:
+    """Похожие товары, рассчитанные один раз при загрузке снимка каталога.
+
+    Кандидаты берутся из окна соседей по цене (в своей категории и во всем
+    каталоге), поэтому построение линейно по размеру каталога, а выдача для
+    страницы товара - готовый кортеж ID.
+    """
+
+    def __init__(self, products, limit=MAX_SIMILAR):
+        features = [{
+            'product_id': p['product_id'],
+            'category': p['category'],
+            'price': p['price'],
+            'generation': model_generation(p['model']),
+            'memory_set': frozenset(p['memory_list']),
+            'colors_set': frozenset(p['colors_list']),
+        } for p in products]
+
+        by_price = sorted(features, key=_price_key)
+        by_category = {}
+        for feature in by_price:
+            by_category.setdefault(feature['category'], []).append(feature)
+
+        # Отсортированные списки вместе с их ключами для бинарного поиска
+        everything = (by_price, [_price_key(f) for f in by_price])
+        categories = {name: (ordered, [_price_key(f) for f in ordered]) for name, ordered in by_category.items()}
+
+        neighbours = {}
+        for feature in features:
+            candidates = {}
+            for ordered, keys in (categories[feature['category']], everything):
+                position = bisect_left(keys, _price_key(feature))
+                for other in ordered[max(position - PRICE_WINDOW, 0):position + PRICE_WINDOW + 1]:
+                    if other['product_id'] != feature['product_id']:
+                        candidates[other['product_id']] = other
+
+            ranked = sorted(
+                candidates.values(),
+                key=lambda other: (-similarity_score(feature, other), other['product_id'])
+            )
+            neighbours[feature['product_id']] = tuple(other['product_id'] for other in ranked[:limit])
+
+        self.neighbours = neighbours
+
+    def get(self, product_id, limit=4):
+        """ID похожих товаров (самые похожие первыми)"""
+        return self.neighbours.get(product_id, ())[:limit]
@@ -1,38 +1,41 @@
 # web_db_setup.py
 import sqlite3
+import sys
 import json
 from datetime import datetime
 
-def setup_web_database():
-    """Настройка базы данных для веб-приложения"""
-    conn = sqlite3.connect('iphones_catalog.db')
+from categorize import RuleEngine, apply_rules
+from migrations import migrate
+from parsing import bump_catalog_version
+from publish import publish_database
+from read_model import refresh_read_model
+
+def setup_web_database(rules_path=None, publish=False, db_name='iphones_catalog.db'):
+    """Настройка базы данных для веб-приложения
+    
+    rules_path - JSON с правилами категорий (по умолчанию - categorize.CATEGORY_RULES).
+    publish=True - пересчет в копии базы с атомарной заменой (publish.py).
+    """
+    if publish:
+        return publish_database(lambda path: setup_web_database(rules_path, db_name=path), db_name)
+    
+    conn = sqlite3.connect(db_name)
     cursor = conn.cursor()
     
-    # Добавляем дополнительные поля для веб-отображения
-    try:
-        cursor.execute('ALTER TABLE iphones_catalog ADD COLUMN display_order INTEGER DEFAULT 0')
-        cursor.execute('ALTER TABLE iphones_catalog ADD COLUMN is_featured BOOLEAN DEFAULT 0')
-        cursor.execute('ALTER TABLE iphones_catalog ADD COLUMN category TEXT DEFAULT "iPhone"')
-    except:
-        print("Поля уже существуют")
+    # Поля для веб-отображения входят в схему - достаточно применить миграции
+    migrate(conn)
     
-    # Обновляем порядок отображения (новые товары первыми)
-    cursor.execute('''
-        UPDATE iphones_catalog 
-        SET display_order = rowid, 
-            is_featured = CASE WHEN price > 80000 THEN 1 ELSE 0 END,
-            category = CASE 
-                WHEN model LIKE '%Pro Max%' THEN 'iPhone Pro Max' 
-                WHEN model LIKE '%Pro%' THEN 'iPhone Pro'
-                WHEN model LIKE '%Plus%' THEN 'iPhone Plus'
-                WHEN model LIKE '%Б/У%' THEN 'iPhone Б/У'
-                ELSE 'iPhone'
-            END
-    ''')
+    # Категории, рекомендуемые товары и порядок отображения - по правилам;
+    # в базу пишутся только товары, у которых что-то поменялось
+    engine = RuleEngine.from_file(rules_path) if rules_path else RuleEngine()
+    changed_ids = apply_rules(cursor, engine)
     
+    if changed_ids:
+        refresh_read_model(cursor, changed_ids)
+        bump_catalog_version(cursor)
     conn.commit()
     conn.close()
-    print("✅ База данных настроена для веб-отображения")
+    print(f"✅ База данных настроена для веб-отображения (обновлено товаров: {len(changed_ids)})")
 
 def export_sample_data():
     """Экспорт образца данных для проверки"""
@@ -66,5 +69,6 @@ def export_sample_data():
     conn.close()
 
 if __name__ == "__main__":
-    setup_web_database()
+    # --publish - пересчитать в копии базы и атомарно заменить ею текущую
+    setup_web_database(publish='--publish' in sys.argv)
     export_sample_data()
\ No newline at end of file